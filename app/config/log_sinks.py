@@ -0,0 +1,133 @@
+"""Custom loguru sinks used by the logging configuration."""
+import atexit
+import gzip
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+
+
+class BoundedFileSink:
+    """Log file sink backed by a bounded queue and a single writer thread.
+
+    Callers only enqueue the formatted message and never block on disk I/O.
+    When the queue is full the message is dropped and counted; the count is
+    written to the file once the writer catches up. The writer thread owns the
+    file handle, writes through a buffered handle and performs size-based
+    rotation and age-based retention. Rotated files are optionally gzipped on a
+    separate worker so that compressing a large file never stalls the writer.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        maxsize: int = 10000,
+        buffering: int = 64 * 1024,
+        rotation_bytes: int = 10 * 1024 * 1024,
+        retention_days: int = 30,
+        compression: Optional[str] = None,
+    ):
+        if compression not in (None, "gz"):
+            raise ValueError(f"Unsupported log compression: {compression!r}")
+        self.path = Path(path)
+        self.buffering = buffering
+        self.rotation_bytes = rotation_bytes
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=maxsize)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._compressor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-file-compressor")
+            if compression else None
+        )
+        self._thread = threading.Thread(target=self._worker, name="log-file-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def __call__(self, message: str) -> None:
+        """Queue a formatted log message for the writer thread."""
+        try:
+            self._queue.put_nowait(str(message))
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+
+    def stop(self) -> None:
+        """Flush queued messages and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        if self._compressor is not None:
+            self._compressor.shutdown(wait=True)
+
+    def _worker(self) -> None:
+        self._open()
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            self._write(message)
+            if self._queue.empty():
+                # Idle: report drops and push buffered bytes to disk
+                self._write_dropped_notice()
+                self._file.flush()
+        self._write_dropped_notice()
+        self._file.close()
+
+    def _write(self, message: str) -> None:
+        data = message.encode("utf-8")
+        try:
+            if self._size and self._size + len(data) > self.rotation_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+        except OSError as e:
+            sys.stderr.write(f"BoundedFileSink failed to write to {self.path}: {e}\n")
+
+    def _write_dropped_notice(self) -> None:
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            self._write(f"{datetime.now():%Y-%m-%d %H:%M:%S} | WARNING  | {dropped} log messages dropped: log queue full\n")
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=self.buffering)
+        self._size = self._file.tell()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        rotated = self.path.with_name(
+            f"{self.path.stem}.{datetime.now():%Y-%m-%d_%H-%M-%S_%f}{self.path.suffix}"
+        )
+        os.replace(self.path, rotated)
+        self._open()
+        if self._compressor is not None:
+            self._compressor.submit(self._compress, rotated)
+        self._apply_retention()
+
+    @staticmethod
+    def _compress(rotated: Path) -> None:
+        try:
+            with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                while chunk := src.read(1024 * 1024):
+                    dst.write(chunk)
+            rotated.unlink()
+        except OSError as e:
+            sys.stderr.write(f"BoundedFileSink failed to compress {rotated}: {e}\n")
+
+    def _apply_retention(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        for old_file in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}*"):
+            try:
+                if old_file.stat().st_mtime < cutoff:
+                    old_file.unlink()
+            except OSError:
+                continue
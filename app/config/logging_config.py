@@ -2,11 +2,14 @@
 import sys
 from pathlib import Path
 from loguru import logger
-from .settings import settings
+from .settings import settings, ensure_app_dirs
+from .log_sinks import BoundedFileSink
 
 
 def configure_logging():
     """Configure application logging."""
+    ensure_app_dirs()
+    
     # Remove default handler
     logger.remove()
     
@@ -16,21 +19,26 @@ def configure_logging():
         level=settings.LOG_LEVEL,
         format=settings.LOG_FORMAT,
         colorize=True,
-        backtrace=True,
+        backtrace=settings.DEBUG or settings.LOG_BACKTRACE,
         diagnose=settings.DEBUG,
     )
     
     # File logging
     log_file = settings.LOGS_DIR / "pend_claim_analysis.log"
+    # Bounded queue + writer thread instead of enqueue=True, whose queue is unbounded
     logger.add(
-        log_file,
-        rotation="10 MB",
-        retention="30 days",
+        BoundedFileSink(
+            log_file,
+            maxsize=settings.LOG_QUEUE_MAXSIZE,
+            buffering=settings.LOG_FILE_BUFFER_SIZE,
+            rotation_bytes=10 * 1024 * 1024,
+            retention_days=30,
+            compression=settings.LOG_COMPRESSION,
+        ),
         level=settings.LOG_LEVEL,
         format=settings.LOG_FORMAT,
-        backtrace=True,
+        backtrace=settings.DEBUG or settings.LOG_BACKTRACE,
         diagnose=settings.DEBUG,
-        enqueue=True,  # For async safety
     )
     
     logger.info(f"Logging configured. Log file: {log_file}")
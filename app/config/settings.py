@@ -1,5 +1,6 @@
 """Application configuration settings."""
 from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -18,12 +19,46 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = f"sqlite:///{DATA_DIR}/claims.db"
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 3600
+    # Claims processed at once by a batch run; keep at or below the pool size
+    BATCH_CONCURRENCY: int = 8
 
     # Gemini
     GEMINI_API_KEY: str
     
+    # Azure OpenAI
+    AZURE_OPENAI_API_KEY: str
+    AZURE_OPENAI_ENDPOINT: str
+    AZURE_OPENAI_API_TYPE: str
+    OPENAI_API_VERSION: str
+    AZURE_OPENAI_DEPLOYMENT_NAME: str
+    MODEL_NAME: str
+    
+    # Serialization of JSON stored in Text columns; falls back to the stdlib when orjson is missing
+    JSON_USE_ORJSON: bool = True
+    
+    # MCP
+    MCP_SERVER_URL: str = "http://127.0.0.1:8000/sse"
+    MCP_TOOLS_TTL_SECONDS: float = 60.0
+    # Seconds the SOP index (code -> version) is trusted before SOPLoader re-checks it in the background
+    SOP_INDEX_TTL_SECONDS: float = 60.0
+    # When off, the MCP server serves only the database tools and skips LLM/FAISS setup
+    ENABLE_POLICY_EXTRACTION: bool = True
+    
     # Logging
     LOG_LEVEL: str = "DEBUG"
+    # Extended tracebacks are costly per exception record: backtrace walks the whole
+    # frame stack and diagnose repr()s every local. Both follow DEBUG; LOG_BACKTRACE
+    # turns on backtrace alone (without variable values) outside of debug mode.
+    LOG_BACKTRACE: bool = False
+    # File sink: max queued records before new ones are dropped, and write buffer size in bytes
+    LOG_QUEUE_MAXSIZE: int = 10000
+    LOG_FILE_BUFFER_SIZE: int = 64 * 1024
+    # Compression for rotated log files ("gz" or unset); runs on its own worker thread
+    LOG_COMPRESSION: Optional[str] = None
     LOG_FORMAT: str = "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
     
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra='ignore')
@@ -32,6 +67,8 @@ class Settings(BaseSettings):
 # Create instance of settings
 settings = Settings()
 
-# Create necessary directories
-settings.LOGS_DIR.mkdir(exist_ok=True)
-settings.DATA_DIR.mkdir(exist_ok=True)
+
+def ensure_app_dirs():
+    """Create the log and data directories if they do not exist yet."""
+    settings.LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    settings.DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -5,45 +5,41 @@
 """MCP (Model Context Protocol) client for executing SQL queries and policy extraction using LangChain."""
 import json
 import asyncio
-from typing import Dict, Any, List, Optional, TypedDict
+import functools
+import threading
+import time
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple, TypedDict
 from pydantic import BaseModel, Field
-from dotenv import load_dotenv
-import os
 
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.tools import tool as langchain_tool_decorator
+from langchain_core.tools import BaseTool, tool as langchain_tool_decorator
 from langchain_openai import AzureChatOpenAI
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import create_react_agent
 
 from app.config.logging_config import logger
+from app.config.settings import settings
+from app.sops.models import build_sop_index
 
-load_dotenv()
-
-# Check required environment variables
-required_env_vars = [
-    "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT",
-    "AZURE_OPENAI_API_TYPE", "OPENAI_API_VERSION",
-    "AZURE_OPENAI_DEPLOYMENT_NAME", "MODEL_NAME"
-]
-missing_vars = [var for var in required_env_vars if not os.getenv(var)]
-if missing_vars:
-    error_msg = f"Missing required environment variables: {', '.join(missing_vars)}. Please check your .env file or environment settings."
-    logger.critical(error_msg)
-
-# Set environment variables for the LangChain Azure client library
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
-os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
-os.environ["AZURE_OPENAI_API_TYPE"] = os.getenv("AZURE_OPENAI_API_TYPE")
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so existing handlers still apply
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+    _loads = json.loads
 
 try:
     # Initialize the AzureChatOpenAI client
     llm = AzureChatOpenAI(
         temperature=0,  # Use low temperature for deterministic, factual responses
-        azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-        model_name=os.getenv("MODEL_NAME"),
-        openai_api_version=os.getenv("OPENAI_API_VERSION")
+        azure_deployment=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
+        model_name=settings.MODEL_NAME,
+        openai_api_version=settings.OPENAI_API_VERSION,
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        api_key=settings.AZURE_OPENAI_API_KEY
     )
     logger.info("AzureChatOpenAI LLM client initialized successfully.")
 except Exception as e:
@@ -51,18 +47,182 @@ except Exception as e:
     logger.critical(error_msg, exc_info=True)
 
 # Initialize MCP Client
-MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://127.0.0.1:8000/sse")
+MCP_SERVER_URL = settings.MCP_SERVER_URL
+MCP_SERVER_NAME = "sop_database"
+MCP_TRANSPORT = "sse"
 client = MultiServerMCPClient(
     {
-        "sop_database": {
+        MCP_SERVER_NAME: {
             "url": MCP_SERVER_URL,  # Your MCP SSE server URL
-            "transport": "sse",
+            "transport": MCP_TRANSPORT,
         }
     }
 )
 
-# Global tools variable
-tools: Optional[List[Any]] = None
+class _PersistentSession:
+    """Keeps one MCP client session open for the lifetime of the current event loop.
+    
+    Tools returned by client.get_tools() open a new SSE session for every call.
+    Tools loaded from a long-lived session reuse its connection instead. The
+    session context is entered and exited inside a dedicated task, as the
+    underlying transport requires.
+    """
+    
+    def __init__(self, server_name: str):
+        self.server_name = server_name
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.current_thread()
+        self.session = None
+        self._error: Optional[BaseException] = None
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = self.loop.create_task(self._run())
+    
+    async def _run(self):
+        try:
+            async with client.session(self.server_name) as session:
+                self.session = session
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            self._error = e
+        finally:
+            self.session = None
+            self._ready.set()
+    
+    def is_alive(self) -> bool:
+        """Whether the session is still usable from the running event loop."""
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return current_loop is self.loop and not self._task.done()
+    
+    async def wait_ready(self):
+        """Wait for the session to open and return it."""
+        await self._ready.wait()
+        if self.session is None:
+            raise RuntimeError(f"Could not open MCP session for '{self.server_name}': {self._error}")
+        return self.session
+    
+    def is_orphaned(self) -> bool:
+        """Whether the owning loop can never run again (closed, or its thread has exited)."""
+        return self.loop.is_closed() or not self.thread.is_alive()
+    
+    async def aclose(self):
+        """Close the session and wait for its task to finish."""
+        self._closing.set()
+        await self._task
+
+# Open MCP sessions keyed by (loop id, server_name, transport). Sync callers run on one
+# loop per thread, so each loop keeps its own session instead of replacing a shared one.
+_server_sessions: Dict[Tuple[int, str, str], _PersistentSession] = {}
+_server_sessions_lock = threading.Lock()
+
+def _prune_server_sessions() -> None:
+    """Drop sessions whose loop is gone; the caller must hold _server_sessions_lock."""
+    for key, persistent in list(_server_sessions.items()):
+        if persistent.is_orphaned():
+            del _server_sessions[key]
+
+async def _get_server_session(server_name: str = MCP_SERVER_NAME, transport: str = MCP_TRANSPORT) -> _PersistentSession:
+    """Return the running loop's open session for a server, opening a new one if needed."""
+    key = (id(asyncio.get_running_loop()), server_name, transport)
+    with _server_sessions_lock:
+        persistent = _server_sessions.get(key)
+        if persistent is None or not persistent.is_alive():
+            _prune_server_sessions()
+            logger.debug(f"Opening persistent MCP session for '{server_name}' ({transport}).")
+            persistent = _PersistentSession(server_name)
+            _server_sessions[key] = persistent
+    await persistent.wait_ready()
+    return persistent
+
+# Seconds a fetched tool list stays fresh before it is re-fetched from the server
+MCP_TOOLS_TTL_SECONDS = settings.MCP_TOOLS_TTL_SECONDS
+
+class _LoopTools:
+    """MCP tools, and the agent built on them, cached for one event loop.
+    
+    The tools are bound to that loop's persistent session and asyncio locks to
+    the loop that first waits on them, so none of this is shared across loops.
+    """
+    
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.current_thread()
+        # Cached MCP tools; refreshed by initialize_mcp_tools() once expired
+        self.tools: Optional[List[Any]] = None
+        self.expires_at = 0.0
+        self.session: Optional[_PersistentSession] = None
+        # Name -> tool index over the cached tools, rebuilt whenever the cache is refreshed
+        self.by_name: Dict[str, Any] = {}
+        # Bumped whenever the set of available tools changes, so the agent is rebuilt
+        self.version = 0
+        self.lock = asyncio.Lock()
+        self.warmup_task: Optional[asyncio.Task] = None
+        # Result-processing agent, shared across workflow runs on this loop
+        self.agent = None
+        self.agent_version = -1
+        self.agent_lock = asyncio.Lock()
+    
+    def cached_tools(self) -> Optional[List[Any]]:
+        """Return the cached tool list if it has not expired and its session is still open."""
+        if self.tools is None or time.monotonic() >= self.expires_at:
+            return None
+        if self.session is not None and not self.session.is_alive():
+            return None
+        return self.tools
+    
+    def is_orphaned(self) -> bool:
+        """Whether the owning loop can never run again (closed, or its thread has exited)."""
+        return self.loop.is_closed() or not self.thread.is_alive()
+
+# Tool caches keyed by loop id, like _server_sessions
+_loop_tools: Dict[int, _LoopTools] = {}
+_loop_tools_lock = threading.Lock()
+
+def _get_loop_tools() -> _LoopTools:
+    """Return the running loop's tool cache, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _loop_tools_lock:
+        state = _loop_tools.get(id(loop))
+        # A reused id may belong to a finished loop
+        if state is None or state.loop is not loop:
+            for key, other in list(_loop_tools.items()):
+                if other.is_orphaned():
+                    del _loop_tools[key]
+            state = _loop_tools[id(loop)] = _LoopTools()
+    return state
+
+# Fallback SQL used when the dedicated MCP tools are unavailable
+_SQL_GET_ALL_SOPS = "SELECT id, sop_code, step_number, description, query FROM SOP ORDER BY sop_code, step_number"
+_SQL_GET_SOP_BY_CODE = "SELECT id, sop_code, step_number, description, query FROM SOP WHERE UPPER(sop_code) = :sop_code ORDER BY step_number"
+_SQL_GET_SOP_INDEX = "SELECT sop_code, step_number, description, query FROM SOP ORDER BY UPPER(sop_code), step_number"
+_SQL_LIST_TABLES = "SELECT name FROM sqlite_master WHERE type='table';"
+
+# Maximum number of result rows sent to the LLM when summarizing a query result
+SUMMARY_MAX_ROWS = 50
+
+def _truncate_result(query_result: Dict[str, Any], max_rows: int = SUMMARY_MAX_ROWS) -> Dict[str, Any]:
+    """Return query_result with its data capped at max_rows, noting how many rows were dropped."""
+    data = query_result.get("data")
+    if not isinstance(data, list) or len(data) <= max_rows:
+        return query_result
+    truncated = dict(query_result)
+    truncated["data"] = data[:max_rows] + [f"... ({len(data) - max_rows} more rows)"]
+    return truncated
+
+def _dumps_compact(obj: Any) -> str:
+    """Serialize obj to compact JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode()
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+@functools.lru_cache(maxsize=256)
+def _thread_id_for(query: str) -> str:
+    """Return a stable LangGraph thread id for a query."""
+    return f"mcp-query-{hash(query)}"
 
 class MCPQueryResult(BaseModel):
     """Result of an MCP query execution."""
@@ -71,6 +231,7 @@ class MCPQueryResult(BaseModel):
     error: Optional[str] = Field(default=None, description="Error message if the query failed")
     execution_time_ms: Optional[float] = Field(default=None, description="Query execution time in milliseconds")
     row_count: Optional[int] = Field(default=None, description="Number of rows returned")
+    summary: Optional[str] = Field(default=None, description="LLM summary of the results, only set when requested")
 
 class MCPPolicyResult(BaseModel):
     """Result of policy extraction."""
@@ -86,18 +247,35 @@ class MCPWorkflowState(TypedDict):
     params: Optional[Dict[str, Any]]
     database: str
     query_result: Optional[Dict[str, Any]]
-    error_message: Optional[str]
+    errors: List[str]
     execution_time_ms: Optional[float]
+    need_summary: bool
 
 async def initialize_mcp_tools():
-    """Initialize MCP tools from the server."""
-    global tools
+    """Initialize MCP tools from the server, reusing the running loop's list until its TTL expires."""
+    state = _get_loop_tools()
+    cached = state.cached_tools()
+    if cached is not None:
+        return cached
     
-    if tools is None:
-        logger.debug("MCP tools not initialized. Calling client.get_tools().")
+    async with state.lock:
+        # Another coroutine may have refreshed the cache while we were waiting
+        cached = state.cached_tools()
+        if cached is not None:
+            return cached
+        
+        logger.debug("MCP tools cache empty or expired. Loading tools from the MCP server.")
         fetched_tools_from_client = []
+        persistent = None
         try:
-            fetched_tools_from_client = await client.get_tools()
+            try:
+                persistent = await _get_server_session()
+                fetched_tools_from_client = await load_mcp_tools(persistent.session)
+            except Exception as session_e:
+                # Fall back to tools that open a session per call
+                logger.warning(f"Persistent MCP session unavailable ({session_e}); falling back to client.get_tools().")
+                persistent = None
+                fetched_tools_from_client = await client.get_tools()
             
             if not isinstance(fetched_tools_from_client, list):
                 logger.error(f"client.get_tools() did not return a list, but: {type(fetched_tools_from_client)}. Setting tools to empty list.")
@@ -105,70 +283,105 @@ async def initialize_mcp_tools():
             else:
                 valid_tools = []
                 for t in fetched_tools_from_client:
-                    if hasattr(t, 'name') and isinstance(t.name, str) and \
-                       hasattr(t, 'description') and isinstance(t.description, str) and \
-                       (hasattr(t, 'ainvoke') and callable(getattr(t, 'ainvoke'))):
+                    # The MCP adapters return BaseTool instances, which carry name/description/ainvoke
+                    if isinstance(t, BaseTool):
                         valid_tools.append(t)
                     else:
                         logger.warning(f"Item from client.get_tools() is not a valid Langchain tool object: {t}. Type: {type(t)}. Skipping.")
             
-            tools = valid_tools
-            if tools:
-                tool_names = [t.name for t in tools if hasattr(t, 'name')]
+            if valid_tools:
+                tool_names = [t.name for t in valid_tools]
                 logger.info(f"Successfully initialized MCP tools: {tool_names}")
             elif not fetched_tools_from_client:
-                logger.warning("client.get_tools() returned no tools or an invalid format. Global tools list is empty.")
+                logger.warning("client.get_tools() returned no tools or an invalid format. Cached tools list is empty.")
             else:
-                logger.warning("client.get_tools() returned items, but none were valid Langchain tools. Global tools list is empty.")
+                logger.warning("client.get_tools() returned items, but none were valid Langchain tools. Cached tools list is empty.")
         except Exception as e:
             logger.error(f"Failed to fetch or process MCP tools: {e}", exc_info=True)
-            tools = []
-    else:
-        if tools:
-            logger.debug(f"MCP tools already initialized: {[tool.name for tool in tools if hasattr(tool, 'name')]}")
-        else:
-            logger.debug("Global tools variable was not None, but is empty. Consider re-initialization if this is unexpected.")
+            # Keep serving the previous tool list (if any) until the next refresh attempt
+            valid_tools = state.tools or []
+            persistent = state.session
+        
+        if set(state.by_name) != {t.name for t in valid_tools}:
+            state.version += 1
+        state.tools = valid_tools
+        state.session = persistent
+        state.by_name = {t.name: t for t in valid_tools}
+        state.expires_at = time.monotonic() + MCP_TOOLS_TTL_SECONDS
+    
+    return state.tools
+
+def _get_tool(name: str) -> Optional[BaseTool]:
+    """Return the running loop's cached tool with the given name, if any."""
+    return _get_loop_tools().by_name.get(name)
+
+def _schedule_tools_warmup() -> None:
+    """Start fetching MCP tools in the background when an event loop is already running."""
+    try:
+        state = _get_loop_tools()
+    except RuntimeError:
+        # No running loop (e.g. plain import); the first workflow run fetches the tools instead
+        return
+    if state.cached_tools() is not None:
+        return
+    if state.warmup_task is not None and not state.warmup_task.done():
+        return
+    state.warmup_task = state.loop.create_task(initialize_mcp_tools())
+
+async def _get_response_agent():
+    """Return the running loop's result-processing agent, rebuilding it if the tool set changed."""
+    state = _get_loop_tools()
+    if state.agent is not None and state.agent_version == state.version:
+        return state.agent
     
-    return tools
+    async with state.agent_lock:
+        if state.agent is None or state.agent_version != state.version:
+            logger.debug(f"Building result-processing agent for tools version {state.version}.")
+            state.agent = create_react_agent(model=llm, tools=state.tools or [])
+            state.agent_version = state.version
+    return state.agent
 
 async def mcp_initialize_state(initial_input: Dict[str, Any]) -> MCPWorkflowState:
     """Initialize the MCP workflow state."""
     logger.info("MCP Workflow: Initializing state.")
-    await initialize_mcp_tools()
+    # Tool discovery runs in the background; execute_query waits for it only if needed
+    _schedule_tools_warmup()
     return {
         "query": initial_input.get("query", ""),
         "params": initial_input.get("params", {}),
         "database": initial_input.get("database", "default"),
         "query_result": None,
-        "error_message": None,
+        "errors": [],
         "execution_time_ms": None,
+        "need_summary": bool(initial_input.get("need_summary", False)),
     }
 
 async def mcp_execute_query_node(state: MCPWorkflowState) -> MCPWorkflowState:
     """Execute SQL query using MCP tools."""
     logger.info("MCP Workflow: Entering execute_query_node.")
-    current_error = state.get('error_message') or ""
+    errors = state["errors"]
     
-    global tools
-    if not tools:
+    # Reject malformed requests before waiting on any I/O
+    query = state["query"].strip()
+    if not query:
+        errors.append("Query is empty.")
+        logger.warning("MCP Workflow: Query is empty.")
+        return state
+    
+    # Returns immediately when the tools are warm, otherwise joins the in-flight fetch
+    if not await initialize_mcp_tools():
         logger.error("MCP tools are not initialized. Cannot execute query.")
-        state['error_message'] = (current_error + " Internal error: MCP tools not available.").strip()
+        errors.append("Internal error: MCP tools not available.")
         return state
     
     # Find the execute_query tool
-    execute_tool = next((t for t in tools if hasattr(t, 'name') and t.name == "execute_query"), None)
+    execute_tool = _get_tool("execute_query")
     if not execute_tool:
         logger.error("'execute_query' tool not found in initialized MCP tools.")
-        state['error_message'] = (current_error + " Internal error: execute_query tool is missing.").strip()
+        errors.append("Internal error: execute_query tool is missing.")
         return state
     
-    query = state.get("query", "").strip()
-    if not query:
-        state['error_message'] = (current_error + " Query is empty.").strip()
-        logger.warning(f"MCP Workflow: {state['error_message']}")
-        return state
-    
-    params = state.get("params", {})
+    params = state["params"]
     logger.info(f"MCP Workflow: Executing query via tool: '{query[:100]}...'")
     
     try:
@@ -181,19 +394,27 @@ async def mcp_execute_query_node(state: MCPWorkflowState) -> MCPWorkflowState:
         # Execute the tool
         tool_response_raw = await execute_tool.ainvoke(tool_input)
         processed_tool_response = None
+        response_type = type(tool_response_raw)
         
-        if isinstance(tool_response_raw, dict):
+        # Exact type checks first: plain dict/str are the expected shapes
+        if response_type is dict:
             processed_tool_response = tool_response_raw
-        elif isinstance(tool_response_raw, str):
+        elif response_type is str:
             logger.debug(f"MCP tool returned a string. Attempting to parse as JSON.")
-            try:
-                processed_tool_response = json.loads(tool_response_raw)
-                if not isinstance(processed_tool_response, dict):
-                    logger.error(f"Parsed JSON from tool string is not a dict. Type: {type(processed_tool_response)}")
-                    processed_tool_response = {"success": False, "error": "Tool returned string that parsed to non-dict.", "details": tool_response_raw}
-            except json.JSONDecodeError as json_e:
-                logger.error(f"Failed to parse string from MCP tool as JSON: {json_e}")
-                processed_tool_response = {"success": False, "error": "Tool returned unparsable string.", "details": tool_response_raw}
+            if not tool_response_raw:
+                logger.error("MCP tool returned an empty string.")
+                processed_tool_response = {"success": False, "error": "Tool returned an empty string.", "details": tool_response_raw}
+            else:
+                try:
+                    processed_tool_response = _loads(tool_response_raw)
+                    if type(processed_tool_response) is not dict:
+                        logger.error(f"Parsed JSON from tool string is not a dict. Type: {type(processed_tool_response)}")
+                        processed_tool_response = {"success": False, "error": "Tool returned string that parsed to non-dict.", "details": tool_response_raw}
+                except json.JSONDecodeError as json_e:
+                    logger.error(f"Failed to parse string from MCP tool as JSON: {json_e}")
+                    processed_tool_response = {"success": False, "error": "Tool returned unparsable string.", "details": tool_response_raw}
+        elif isinstance(tool_response_raw, dict):
+            processed_tool_response = dict(tool_response_raw)
         else:
             logger.warning(f"MCP tool returned unexpected type. Type: {type(tool_response_raw)}, Response: {str(tool_response_raw)[:200]}")
             processed_tool_response = {"success": False, "error": "Unexpected tool output type.", "details": str(tool_response_raw)}
@@ -206,15 +427,15 @@ async def mcp_execute_query_node(state: MCPWorkflowState) -> MCPWorkflowState:
         elif processed_tool_response and not processed_tool_response.get("success"):
             error_msg = processed_tool_response.get("error", "Unknown error")
             logger.warning(f"MCP query execution failed: {error_msg}")
-            state['error_message'] = (current_error + f" Query execution failed: {error_msg}").strip()
+            errors.append(f"Query execution failed: {error_msg}")
         else:
             logger.error("MCP tool returned invalid response format.")
-            state['error_message'] = (current_error + " Invalid response format from MCP tool.").strip()
+            errors.append("Invalid response format from MCP tool.")
         
     except Exception as e:
         logger.error(f"Exception invoking MCP execute_query tool: {e}", exc_info=True)
         state["query_result"] = {"success": False, "error": f"Exception during tool call: {str(e)}"}
-        state['error_message'] = (current_error + f" Error executing query: {str(e)}").strip()
+        errors.append(f"Error executing query: {str(e)}")
     
     logger.debug(f"MCP State after query execution: {state}")
     return state
@@ -225,14 +446,14 @@ async def mcp_process_results_node(state: MCPWorkflowState) -> MCPWorkflowState:
     
     query_result = state.get("query_result")
     query = state.get("query", "")
-    error_message = state.get("error_message")
+    errors = state["errors"]
     
-    if error_message:
-        logger.warning(f"Processing results with existing error: {error_message}")
+    if errors:
+        logger.warning(f"Processing results with existing errors: {' '.join(errors)}")
         return state
     
     if not query_result:
-        state['error_message'] = "No query result to process."
+        errors.append("No query result to process.")
         return state
     
     # Create agent for result processing
@@ -251,13 +472,13 @@ async def mcp_process_results_node(state: MCPWorkflowState) -> MCPWorkflowState:
     SQL Query: {query}
     
     Query Result:
-    {json.dumps(query_result, indent=2)}
+    {_dumps_compact(_truncate_result(query_result))}
     
     Please process and format this result for the user.
     """
     
     try:
-        response_agent = create_react_agent(model=llm, tools=tools or [])
+        response_agent = await _get_response_agent()
         
         agent_messages = [
             SystemMessage(content=system_prompt),
@@ -300,57 +521,110 @@ def build_mcp_workflow():
     
     workflow.set_entry_point("initialize_state")
     workflow.add_edge("initialize_state", "execute_query")
-    workflow.add_edge("execute_query", "process_results")
+    # Only pay for the LLM summary when the caller asked for it
+    workflow.add_conditional_edges(
+        "execute_query",
+        lambda state: "process_results" if state.get("need_summary") else END,
+        {"process_results": "process_results", END: END}
+    )
     workflow.add_edge("process_results", END)
     
     compiled_workflow = workflow.compile()
     logger.info("MCP workflow compiled successfully.")
     return compiled_workflow
 
-# Create the workflow app
-mcp_workflow_app = build_mcp_workflow()
+@functools.lru_cache(maxsize=1)
+def get_mcp_workflow_app():
+    """Return the compiled MCP workflow, building it on first use."""
+    return build_mcp_workflow()
 
 class MCPLangChainClient:
     """LangChain-based MCP client with React Agent capabilities."""
     
     def __init__(self):
         """Initialize the MCP LangChain client."""
-        self.workflow = mcp_workflow_app
+        self.workflow = get_mcp_workflow_app()
+        # In-flight read queries keyed by (loop, query, params, database, summarize)
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        _schedule_tools_warmup()
+    
+    @staticmethod
+    def _inflight_key(
+        query: str,
+        params: Optional[Dict[str, Any]],
+        database: str,
+        summarize: bool
+    ) -> Optional[Tuple]:
+        """Build the coalescing key for a query, or None if it must not be shared."""
+        # Only reads are safe to share; identical writes must each run
+        if not query.lstrip()[:6].upper() == "SELECT":
+            return None
+        try:
+            params_key = frozenset((params or {}).items())
+            hash(params_key)
+        except TypeError:
+            return None
+        return (asyncio.get_running_loop(), query, params_key, database, summarize)
     
     async def execute_query(
         self,
         query: str,
         params: Optional[Dict[str, Any]] = None,
-        database: str = "default"
+        database: str = "default",
+        summarize: bool = False
     ) -> MCPQueryResult:
         """Execute a SQL query via the MCP workflow.
         
+        Concurrent calls with the same SELECT query and parameters share a single
+        workflow run and receive the same result object.
+        
         Args:
             query: SQL query to execute
             params: Optional query parameters
             database: Target database name
+            summarize: Whether to run the LLM result-processing step and return its summary
         
         Returns:
             MCPQueryResult containing the query results or error
         """
+        key = self._inflight_key(query, params, database, summarize)
+        if key is None:
+            return await self._run_query_workflow(query, params, database, summarize)
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_query_workflow(query, params, database, summarize))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _task, key=key: self._inflight.pop(key, None))
+        else:
+            logger.debug(f"Joining in-flight MCP query: {query[:200]}...")
+        # Shield so one cancelled caller does not cancel the run the others are waiting on
+        return await asyncio.shield(task)
+    
+    async def _run_query_workflow(
+        self,
+        query: str,
+        params: Optional[Dict[str, Any]],
+        database: str,
+        summarize: bool
+    ) -> MCPQueryResult:
+        """Run the MCP workflow for a single query."""
         try:
             input_data = {
                 "query": query,
                 "params": params or {},
-                "database": database
+                "database": database,
+                "need_summary": summarize
             }
             
             logger.debug(f"Executing MCP query via workflow: {query[:200]}...")
             
-            final_state = None
-            config = {"configurable": {"thread_id": f"mcp-query-{hash(query)}"}}
-            
-            async for event_chunk in self.workflow.astream(input_data, config=config, stream_mode="values"):
-                final_state = event_chunk
+            config = {"configurable": {"thread_id": _thread_id_for(query)}}
+            final_state = await self.workflow.ainvoke(input_data, config=config)
             
             if final_state:
                 query_result = final_state.get("query_result", {})
-                error_message = final_state.get("error_message")
+                error_message = " ".join(final_state.get("errors") or [])
                 
                 if error_message:
                     return MCPQueryResult(
@@ -364,7 +638,8 @@ class MCPLangChainClient:
                         success=True,
                         data=query_result.get("data"),
                         execution_time_ms=query_result.get("execution_time_ms"),
-                        row_count=query_result.get("row_count")
+                        row_count=query_result.get("row_count"),
+                        summary=query_result.get("processed_summary")
                     )
                 else:
                     return MCPQueryResult(
@@ -390,16 +665,14 @@ class MCPLangChainClient:
     
     async def get_all_sops(self) -> MCPQueryResult:
         """Retrieve all SOP steps from the database."""
-        global tools
-        if not tools:
-            await initialize_mcp_tools()
+        await initialize_mcp_tools()
         
         # Try to use the dedicated tool first
-        get_all_sops_tool = next((t for t in tools if hasattr(t, 'name') and t.name == "get_all_sops"), None)
+        get_all_sops_tool = _get_tool("get_all_sops")
         if get_all_sops_tool:
             try:
                 result_str = await get_all_sops_tool.ainvoke({})
-                result_data = json.loads(result_str) if isinstance(result_str, str) else result_str
+                result_data = _loads(result_str) if isinstance(result_str, str) else result_str
                 
                 if result_data.get("success"):
                     return MCPQueryResult(
@@ -416,20 +689,81 @@ class MCPLangChainClient:
                 logger.error(f"Error using get_all_sops tool: {e}")
         
         # Fallback to execute_query
-        return await self.execute_query("SELECT id, sop_code, step_number, description, query FROM SOP ORDER BY sop_code, step_number")
+        return await self.execute_query(_SQL_GET_ALL_SOPS)
+    
+    async def stream_all_sops(self, page_size: int = 100) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every SOP step row, ordered by upper-cased SOP code and step number.
+        
+        Rows are fetched a page of whole SOPs at a time, so callers can build and
+        release each SOP's rows before the next page arrives.
+        """
+        await initialize_mcp_tools()
+        
+        get_sops_page_tool = _get_tool("get_sops_page")
+        if get_sops_page_tool is None:
+            # Older servers: fetch everything at once, in the same order the pages would use
+            result = await self.get_all_sops()
+            if not result.success:
+                raise RuntimeError(f"Failed to fetch SOPs from MCP: {result.error}")
+            for row in sorted(result.data or [], key=lambda r: ((r.get("sop_code") or "").upper(), r.get("step_number") or 0)):
+                yield row
+            return
+        
+        after_code = ""
+        while True:
+            result_str = await get_sops_page_tool.ainvoke({"after_sop_code": after_code, "limit": page_size})
+            result_data = _loads(result_str) if isinstance(result_str, str) else result_str
+            if not result_data.get("success"):
+                raise RuntimeError(f"Failed to fetch SOPs from MCP: {result_data.get('error', 'Unknown error')}")
+            rows = result_data.get("data") or []
+            if not rows:
+                return
+            for row in rows:
+                yield row
+            after_code = (rows[-1].get("sop_code") or "").upper()
+    
+    async def get_sop_index(self) -> MCPQueryResult:
+        """Retrieve the step count and content version of every SOP code."""
+        await initialize_mcp_tools()
+        
+        # Try to use the dedicated tool first
+        get_sop_index_tool = _get_tool("get_sop_index")
+        if get_sop_index_tool:
+            try:
+                result_str = await get_sop_index_tool.ainvoke({})
+                result_data = _loads(result_str) if isinstance(result_str, str) else result_str
+                
+                if result_data.get("success"):
+                    return MCPQueryResult(
+                        success=True,
+                        data=result_data.get("data"),
+                        row_count=result_data.get("count")
+                    )
+                else:
+                    return MCPQueryResult(
+                        success=False,
+                        error=result_data.get("error", "Unknown error")
+                    )
+            except Exception as e:
+                logger.error(f"Error using get_sop_index tool: {e}")
+        
+        # Fallback to execute_query, reducing the rows to the same index here
+        result = await self.execute_query(_SQL_GET_SOP_INDEX)
+        if not result.success:
+            return result
+        index = build_sop_index(result.data or [])
+        return MCPQueryResult(success=True, data=index, row_count=len(index))
     
     async def get_sop_by_code(self, sop_code: str) -> MCPQueryResult:
         """Retrieve all steps for a specific SOP code."""
-        global tools
-        if not tools:
-            await initialize_mcp_tools()
+        await initialize_mcp_tools()
         
         # Try to use the dedicated tool first
-        get_sop_by_code_tool = next((t for t in tools if hasattr(t, 'name') and t.name == "get_sop_by_code"), None)
+        get_sop_by_code_tool = _get_tool("get_sop_by_code")
         if get_sop_by_code_tool:
             try:
                 result_str = await get_sop_by_code_tool.ainvoke({"sop_code": sop_code.upper()})
-                result_data = json.loads(result_str) if isinstance(result_str, str) else result_str
+                result_data = _loads(result_str) if isinstance(result_str, str) else result_str
                 
                 if result_data.get("success"):
                     return MCPQueryResult(
@@ -446,26 +780,18 @@ class MCPLangChainClient:
                 logger.error(f"Error using get_sop_by_code tool: {e}")
         
         # Fallback to execute_query
-        return await self.execute_query(
-            "SELECT id, sop_code, step_number, description, query FROM SOP WHERE sop_code = :sop_code ORDER BY step_number",
-            {"sop_code": sop_code.upper()}
-        )
+        return await self.execute_query(_SQL_GET_SOP_BY_CODE, {"sop_code": sop_code.upper()})
     
     async def get_database_schema(self) -> MCPQueryResult:
         """Get the database schema information."""
-        global tools
-        if not tools:
-            await initialize_mcp_tools()
+        await initialize_mcp_tools()
 
         # Try to use the dedicated tool first
-        get_schema_tool = next(
-            (t for t in tools if hasattr(t, 'name') and t.name == "get_database_schema"),
-            None
-        )
+        get_schema_tool = _get_tool("get_database_schema")
         if get_schema_tool:
             try:
                 result_str = await get_schema_tool.ainvoke({})
-                result_data = json.loads(result_str) if isinstance(result_str, str) else result_str
+                result_data = _loads(result_str) if isinstance(result_str, str) else result_str
 
                 if result_data.get("success"):
                     # Wrap schema dict into a list of {table, columns} entries
@@ -488,7 +814,7 @@ class MCPLangChainClient:
                 logger.error(f"Error using get_database_schema tool: {e}")
 
         # Fallback to basic query
-        return await self.execute_query("SELECT name FROM sqlite_master WHERE type='table';")
+        return await self.execute_query(_SQL_LIST_TABLES)
 
     
     async def extract_policy_by_code(self, code: str, fields: Optional[List[str]] = None) -> MCPPolicyResult:
@@ -501,12 +827,10 @@ class MCPLangChainClient:
         Returns:
             MCPPolicyResult with extracted policy information
         """
-        global tools
-        if not tools:
-            await initialize_mcp_tools()
+        await initialize_mcp_tools()
         
         # Find the policy extraction tool
-        policy_tool = next((t for t in tools if hasattr(t, 'name') and t.name == "extract_policy_json_by_code"), None)
+        policy_tool = _get_tool("extract_policy_json_by_code")
         if not policy_tool:
             return MCPPolicyResult(
                 success=False,
@@ -521,7 +845,7 @@ class MCPLangChainClient:
                 tool_input["fields"] = fields
                 
             result_str = await policy_tool.ainvoke(tool_input)
-            result_data = json.loads(result_str) if isinstance(result_str, str) else result_str
+            result_data = _loads(result_str) if isinstance(result_str, str) else result_str
             
             return MCPPolicyResult(
                 success=True,
@@ -539,7 +863,75 @@ class MCPLangChainClient:
                 error=f"Policy extraction failed: {str(e)}"
             )
     
+    async def extract_policies_by_codes(self, codes: List[str], fields: Optional[List[str]] = None) -> List[MCPPolicyResult]:
+        """Extract medical policy information for several procedure codes in batched LLM calls.
+        
+        Args:
+            codes: 5-digit procedure codes (e.g., ['27447', '29881'])
+            fields: Optional list of specific fields to return for each code
+        
+        Returns:
+            One MCPPolicyResult per requested code, in the same order
+        """
+        await initialize_mcp_tools()
+        
+        policy_tool = _get_tool("extract_policies_json_by_codes")
+        if not policy_tool:
+            return [
+                MCPPolicyResult(success=False, found=False, code=code, error="Batch policy extraction tool not available")
+                for code in codes
+            ]
+        
+        try:
+            tool_input = {"codes": codes}
+            if fields:
+                tool_input["fields"] = fields
+            
+            result_str = await policy_tool.ainvoke(tool_input)
+            result_data = _loads(result_str) if isinstance(result_str, str) else result_str
+            entries = result_data.get("results", [])
+            
+            return [
+                MCPPolicyResult(
+                    success=True,
+                    found=entry.get("found", False),
+                    code=entry.get("code", code),
+                    data=entry
+                )
+                for code, entry in zip(codes, entries)
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error extracting policies for codes {codes}: {e}", exc_info=True)
+            return [
+                MCPPolicyResult(success=False, found=False, code=code, error=f"Policy extraction failed: {str(e)}")
+                for code in codes
+            ]
+    
+    async def close_all(self):
+        """Close the MCP sessions of every event loop.
+        
+        Sessions of the running loop are closed here; those of another live loop
+        are closed on that loop, and sessions of finished loops are dropped.
+        """
+        with _server_sessions_lock:
+            sessions = list(_server_sessions.items())
+            _server_sessions.clear()
+        for key, persistent in sessions:
+            try:
+                if persistent.is_alive():
+                    await persistent.aclose()
+                elif persistent.loop.is_running():
+                    await asyncio.wrap_future(
+                        asyncio.run_coroutine_threadsafe(persistent.aclose(), persistent.loop)
+                    )
+            except Exception as e:
+                logger.error(f"Error closing MCP session {key}: {e}")
+        with _loop_tools_lock:
+            _loop_tools.clear()
+    
     async def close(self):
+        await self.close_all()
         try:
             if hasattr(client, "aclose") and callable(getattr(client, "aclose")):
                 await client.aclose()
@@ -564,8 +956,18 @@ class MCPLangChainClient:
         """Async context manager exit."""
         await self.close()
 
-# Create a global instance for convenience
-mcp_langchain_client = MCPLangChainClient()
+@functools.lru_cache(maxsize=1)
+def get_mcp_langchain_client() -> MCPLangChainClient:
+    """Return the shared MCPLangChainClient, creating it on first use."""
+    return MCPLangChainClient()
+
+def __getattr__(name: str):
+    # Keep `from app.core.mcp_client import mcp_langchain_client` working without import-time construction
+    if name == "mcp_langchain_client":
+        return get_mcp_langchain_client()
+    if name == "mcp_workflow_app":
+        return get_mcp_workflow_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     async def test_mcp_client():
@@ -600,7 +1002,7 @@ if __name__ == "__main__":
             }
         ]
         
-        async with mcp_langchain_client as client:
+        async with get_mcp_langchain_client() as client:
             for i, test_case in enumerate(test_cases):
                 logger.info(f"\n--- Test Case {i+1}: {test_case['name']} ---")
                 try:
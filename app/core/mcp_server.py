@@ -7,20 +7,38 @@ MCP (Model Context Protocol) server for SOP database access and policy extractio
 This server exposes the consolidated SOP database and medical policy extraction using FastMCP.
 """
 import sqlite3
+import asyncio
+import functools
+import io
+import itertools
 import json
 import os
+import re
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 from mcp.server.fastmcp import FastMCP
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain.prompts import PromptTemplate
-from langchain.output_parsers import ResponseSchema, StructuredOutputParser
+from langchain.output_parsers import ResponseSchema
+from langchain_core.utils.json import parse_json_markdown
 from langchain_openai import AzureChatOpenAI
 from dotenv import load_dotenv
 from ..config.logging_config import logger
+from ..config.settings import settings
+from ..sops.models import build_sop_index
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
 
 load_dotenv()
 
@@ -31,54 +49,85 @@ INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "data")
 # Initialize FastMCP server
 mcp = FastMCP("sop-database-and-policy-extractor")
 
-required_env_vars = [
-    "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT",
-    "AZURE_OPENAI_API_TYPE", "OPENAI_API_VERSION",
-    "AZURE_OPENAI_DEPLOYMENT_NAME", "MODEL_NAME"
-]
-# Check if any required variables are missing
-missing_vars = [var for var in required_env_vars if not os.getenv(var)]
-if missing_vars:
-    # Log critical error and stop the app if configuration is incomplete
-    error_msg = f"Missing required environment variables: {', '.join(missing_vars)}. Please check your .env file or environment settings."
-    logger.critical(error_msg)
-
-# Set environment variables for the LangChain Azure client library
-# (Setting them here ensures they are available even if not set globally before running)
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
-os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
-os.environ["AZURE_OPENAI_API_TYPE"] = os.getenv("AZURE_OPENAI_API_TYPE")
+# Tool bodies are blocking (sqlite3, LLM calls); run them here so concurrent calls overlap.
+# Each worker thread keeps its own WAL-mode connection, so reads proceed in parallel.
+TOOL_EXECUTOR_WORKERS = 8
+_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_EXECUTOR_WORKERS, thread_name_prefix="mcp-tool")
 
-try:
-    # Initialize the AzureChatOpenAI client
-    llm = AzureChatOpenAI(
-        temperature=0, # Use low temperature for deterministic, factual responses
-        azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"), # Name of your Azure deployment
-        model_name=os.getenv("MODEL_NAME"), # Specific model used in the deployment (e.g., gpt-4o)
-        openai_api_version=os.getenv("OPENAI_API_VERSION") # API version (e.g., 2024-05-01-preview)
-    )
-    logger.info("AzureChatOpenAI LLM client initialized successfully.")
-except Exception as e:
-    # Handle errors during LLM client initialization
-    error_msg = f"Failed to initialize Azure OpenAI connection: {e}"
-    logger.critical(error_msg, exc_info=True) # Log exception details
+def _run_in_executor(func):
+    """Expose a blocking tool body as a coroutine that runs on the shared tool executor."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            _EXECUTOR, functools.partial(func, *args, **kwargs)
+        )
+    return wrapper
+
+llm = None
+if settings.ENABLE_POLICY_EXTRACTION:
+    try:
+        # Initialize the AzureChatOpenAI client
+        llm = AzureChatOpenAI(
+            temperature=0, # Use low temperature for deterministic, factual responses
+            azure_deployment=settings.AZURE_OPENAI_DEPLOYMENT_NAME, # Name of your Azure deployment
+            model_name=settings.MODEL_NAME, # Specific model used in the deployment (e.g., gpt-4o)
+            openai_api_version=settings.OPENAI_API_VERSION, # API version (e.g., 2024-05-01-preview)
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            api_key=settings.AZURE_OPENAI_API_KEY
+        )
+        logger.info("AzureChatOpenAI LLM client initialized successfully.")
+    except Exception as e:
+        # Handle errors during LLM client initialization
+        error_msg = f"Failed to initialize Azure OpenAI connection: {e}"
+        logger.critical(error_msg, exc_info=True) # Log exception details
+else:
+    logger.info("Policy extraction disabled; skipping LLM and FAISS initialization")
 
 # --- FAISS Vector Store Setup ---
-_embeddings = None
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+@functools.lru_cache(maxsize=1)
+def _get_embeddings() -> HuggingFaceEmbeddings:
+    """Load the embedding model on first use; fp16 on GPU, fp32 on CPU where fp16 is slower."""
+    import torch
+
+    model_kwargs: Dict[str, Any] = {"device": "cuda" if torch.cuda.is_available() else "cpu"}
+    if model_kwargs["device"] == "cuda":
+        model_kwargs["model_kwargs"] = {"torch_dtype": torch.float16}
+    logger.info(f"Loading embedding model {EMBEDDING_MODEL_NAME} on {model_kwargs['device']}")
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": 64},
+    )
+
+class _LazyEmbeddings(Embeddings):
+    """Embeddings handle for FAISS that defers loading the model until something is embedded."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _get_embeddings().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return _get_embeddings().embed_query(text)
+
+_embeddings = _LazyEmbeddings()
 _vectorstore = None
+_SINGLE_DOC_TEXT: Optional[str] = None
 
 try:
-    if os.path.exists(INDEX_DIR):
-        _embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
+    if settings.ENABLE_POLICY_EXTRACTION and os.path.exists(INDEX_DIR):
+        # Policy extraction reads the docstore only, so the model is normally never loaded
         _vectorstore = FAISS.load_local(
             INDEX_DIR,
             _embeddings,
             allow_dangerous_deserialization=True,
         )
         logger.info(f"FAISS vectorstore loaded from {INDEX_DIR}")
-    else:
+        # The index holds the policy document itself; read it straight from the docstore
+        # instead of embedding a dummy query and searching on every extraction
+        _docs = [_vectorstore.docstore.search(doc_id) for doc_id in _vectorstore.index_to_docstore_id.values()]
+        _SINGLE_DOC_TEXT = "\n\n".join(doc.page_content for doc in _docs if hasattr(doc, "page_content")) or None
+    elif settings.ENABLE_POLICY_EXTRACTION:
         logger.warning(f"FAISS index directory not found: {INDEX_DIR}")
 except Exception as e:
     logger.error(f"Failed to load FAISS vectorstore: {e}")
@@ -105,88 +154,305 @@ response_schemas = [
     ResponseSchema(name="notes", description="Disambiguation notes", type="string"),
 ]
 
+# Number of procedure codes extracted per LLM call; larger batches start to lose accuracy
+POLICY_BATCH_SIZE = 12
+
 if llm:
-    parser = StructuredOutputParser.from_response_schemas(response_schemas)
-    format_instructions = parser.get_format_instructions()
+    entry_schema = "\n".join(
+        f'    "{schema.name}": {schema.type}  // {schema.description}' for schema in response_schemas
+    )
 
     PROMPT = PromptTemplate(
         template=(
             "You are an expert medical policy extractor. "
-            "Given the entire medical policy document text, find the entry for procedure code = {code}.\n\n"
-            "Return ONLY JSON following this exact schema:\n"
-            "{format_instructions}\n\n"
+            "Given the medical policy document text, find the entry for each of these procedure codes: {codes_json}.\n\n"
+            "Return ONLY a JSON object of the form {{\"results\": [...]}} with exactly one entry per requested code, "
+            "in the same order as the codes above. Each entry must follow this schema:\n"
+            "{{\n{entry_schema}\n}}\n\n"
             "Rules:\n"
-            "- If code not found, set found=false and leave other fields empty/null\n"
-            "- Extract exact raw_span text you used for this code\n"
+            "- If a code is not found, set found=false for it and leave its other fields empty/null\n"
+            "- Extract the exact raw_span text you used for each code\n"
             "- Be precise and only return the JSON structure\n\n"
             "# DOCUMENT TEXT START\n{doc_text}\n# DOCUMENT TEXT END"
         ),
-        input_variables=["code", "doc_text"],
-        partial_variables={"format_instructions": format_instructions},
+        input_variables=["codes_json", "doc_text"],
+        partial_variables={"entry_schema": entry_schema},
     )
 
+    # Render the template once and split it around the per-call values, so each
+    # call only concatenates strings instead of re-running PromptTemplate.format
+    _PROMPT_HEAD, _PROMPT_REST = PROMPT.format(codes_json="\x00CODES\x00", doc_text="\x00DOC\x00").split("\x00CODES\x00")
+    _PROMPT_MID, _PROMPT_TAIL = _PROMPT_REST.split("\x00DOC\x00")
+
+def _dumps_compact(obj: Any) -> str:
+    """Serialize obj to compact JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+def _dumps(obj: Any) -> str:
+    """Serialize a tool response: compact, indented only in DEBUG."""
+    if settings.DEBUG:
+        return json.dumps(obj, indent=2, default=str)
+    return _dumps_compact(obj)
+
 # --- Database Connection Functions ---
+# Applied once per connection: WAL lets readers run alongside a writer, and the
+# larger page cache / mmap window survive across calls because connections are reused.
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+_db_local = threading.local()
+# SQLite allows a single writer; serialize DML from this process instead of hitting SQLITE_BUSY
+_db_write_lock = threading.Lock()
+
 def get_db_connection():
-    """Create and return a database connection."""
+    """Return this thread's long-lived database connection, opening it on first use."""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        return conn
     try:
         if not DATABASE_PATH.exists():
             raise FileNotFoundError(f"Database not found at {DATABASE_PATH}")
         
-        conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        # Autocommit mode: each DML statement commits on its own
+        conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False, isolation_level=None)
         conn.row_factory = sqlite3.Row
+        for pragma in _SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        _db_local.conn = conn
         return conn
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         raise e
 
+@contextmanager
+def db_cursor():
+    """Yield a cursor on the shared connection; only the cursor is closed afterwards."""
+    cursor = get_db_connection().cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
 # --- Policy Extraction Helper Functions ---
 def _get_single_doc_text() -> str:
-    """Retrieve the single document from FAISS vectorstore."""
+    """Return the policy document text loaded from the FAISS docstore."""
     if not _vectorstore:
         raise RuntimeError("FAISS vectorstore not initialized")
-    
-    hits = _vectorstore.similarity_search("return the single doc", k=1)
-    if not hits:
+    if not _SINGLE_DOC_TEXT:
         raise RuntimeError("No document found in FAISS index")
-    return hits[0].page_content
+    return _SINGLE_DOC_TEXT
 
-def _extract_policy_json(code: str) -> Dict[str, Any]:
-    """Extract policy information for a given code using LLM."""
-    if not llm or not _vectorstore:
-        return {
-            "found": False,
-            "code": code,
-            "notes": "LLM or vectorstore not available",
-        }
-    
+# Each policy entry starts at a "Code Status" line and names its code on a "Code NNNNN" line
+_POLICY_SECTION_RE = re.compile(r"(?m)^(?=Code Status\b)")
+_POLICY_SECTION_CODE_RE = re.compile(r"(?m)^Code\s+(\w+)\s*$")
+
+@functools.lru_cache(maxsize=1)
+def _policy_sections(doc_text: str) -> Tuple[List[str], Dict[str, int]]:
+    """Split the policy document into per-code entries and index them by procedure code."""
+    sections = [section for section in _POLICY_SECTION_RE.split(doc_text) if section.strip()]
+    section_by_code: Dict[str, int] = {}
+    for index, section in enumerate(sections):
+        for code in _POLICY_SECTION_CODE_RE.findall(section):
+            section_by_code.setdefault(code, index)
+    return sections, section_by_code
+
+def _get_doc_text_for_codes(codes: List[str]) -> str:
+    """Return only the policy entries for the given codes, or the whole document if any is missing."""
+    text = _get_single_doc_text()
+    sections, section_by_code = _policy_sections(text)
+    indexes = [section_by_code.get(code) for code in codes]
+    if None in indexes:
+        # Let the LLM search the full text rather than guess from a partial excerpt
+        return text
+    return "".join(sections[index] for index in sorted(set(indexes)))
+
+# --- Policy Extraction Cache ---
+# Extraction results are cached per (code, document version). Procedure codes are exact
+# identifiers, so only exact matches are reused; a new FAISS index invalidates old entries.
+POLICY_CACHE_PATH = DATABASE_PATH.parent / "policy_cache.db"
+POLICY_MEMORY_CACHE_SIZE = 4096
+_policy_memory_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_policy_cache_conn: Optional[sqlite3.Connection] = None
+_policy_cache_lock = threading.Lock()
+
+class _PolicyExtractionError(Exception):
+    """Raised when the LLM output cannot be used, carrying the fields for the error result."""
+
+    def __init__(self, details: Dict[str, Any]):
+        super().__init__(details.get("notes"))
+        self.details = details
+
+def _policy_doc_version() -> str:
+    """Return a version tag for the policy document, based on the FAISS index mtime."""
     try:
-        text = _get_single_doc_text()
-        prompt = PROMPT.format(code=code, doc_text=text)
-        raw = llm.invoke(prompt).content
-        
+        return str((Path(INDEX_DIR) / "index.faiss").stat().st_mtime_ns)
+    except OSError:
+        return "unknown"
+
+def _get_policy_cache_connection() -> sqlite3.Connection:
+    """Return the connection to the persistent policy cache, creating the table on first use."""
+    global _policy_cache_conn
+    if _policy_cache_conn is None:
+        _policy_cache_conn = sqlite3.connect(POLICY_CACHE_PATH, check_same_thread=False)
+        _policy_cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS policy_cache ("
+            "code TEXT NOT NULL, doc_version TEXT NOT NULL, result TEXT NOT NULL, "
+            "PRIMARY KEY (code, doc_version))"
+        )
+        _policy_cache_conn.commit()
+    return _policy_cache_conn
+
+def _remember_policy(key: Tuple[str, str], result_json: str) -> None:
+    """Add an entry to the in-process LRU, evicting the oldest one when full."""
+    with _policy_cache_lock:
+        _policy_memory_cache[key] = result_json
+        _policy_memory_cache.move_to_end(key)
+        if len(_policy_memory_cache) > POLICY_MEMORY_CACHE_SIZE:
+            _policy_memory_cache.popitem(last=False)
+
+def _policy_cache_lookup(code: str, doc_version: str) -> Optional[str]:
+    """Look up a cached extraction result (as JSON) in memory, then on disk."""
+    key = (code, doc_version)
+    with _policy_cache_lock:
+        cached = _policy_memory_cache.get(key)
+        if cached is not None:
+            _policy_memory_cache.move_to_end(key)
+            return cached
         try:
-            return parser.parse(raw)
-        except Exception:
-            try:
-                return json.loads(raw)
-            except Exception:
-                return {
-                    "found": False,
-                    "code": code,
-                    "notes": "Failed to parse LLM output",
-                    "raw_output": raw[:500]  # Truncate for logging
-                }
-    except Exception as e:
-        logger.error(f"Policy extraction failed for code {code}: {e}")
+            row = _get_policy_cache_connection().execute(
+                "SELECT result FROM policy_cache WHERE code = ? AND doc_version = ?",
+                (code, doc_version)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Policy cache lookup failed for code {code}: {e}")
+            row = None
+    if row is None:
+        return None
+    _remember_policy(key, row[0])
+    return row[0]
+
+def _policy_cache_store(code: str, doc_version: str, result_json: str) -> None:
+    """Store an extraction result (as JSON) in memory and on disk."""
+    _remember_policy((code, doc_version), result_json)
+    try:
+        with _policy_cache_lock:
+            conn = _get_policy_cache_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO policy_cache (code, doc_version, result) VALUES (?, ?, ?)",
+                (code, doc_version, result_json)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Policy cache write failed for code {code}: {e}")
+
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.S)
+
+def _parse_llm_json(raw: str) -> Any:
+    """Parse LLM output as JSON: plain first, then a fenced block, then LangChain's lenient parser."""
+    loads = orjson.loads if orjson is not None else json.loads
+    try:
+        return loads(raw)
+    except ValueError:
+        pass
+    fenced = _JSON_FENCE_RE.search(raw)
+    if fenced:
+        try:
+            return loads(fenced.group(1))
+        except ValueError:
+            pass
+    return parse_json_markdown(raw)
+
+def _invoke_policy_llm_batch(codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Extract several codes with a single LLM call.
+
+    Entries are matched to codes by their "code" field, falling back to their
+    position. Codes without a usable entry are left out of the returned mapping.
+    """
+    text = _get_doc_text_for_codes(codes)
+    prompt = f"{_PROMPT_HEAD}{json.dumps(codes)}{_PROMPT_MID}{text}{_PROMPT_TAIL}"
+    raw = llm.invoke(prompt).content
+
+    try:
+        parsed = _parse_llm_json(raw)
+        entries = parsed.get("results") if isinstance(parsed, dict) else parsed
+        if not isinstance(entries, list):
+            raise ValueError("LLM output has no results list")
+    except Exception:
+        raise _PolicyExtractionError({
+            "notes": "Failed to parse LLM output",
+            "raw_output": raw[:500]  # Truncate for logging
+        })
+
+    requested = set(codes)
+    extracted: Dict[str, Dict[str, Any]] = {}
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        entry_code = str(entry.get("code") or "").strip()
+        if entry_code not in requested:
+            entry_code = codes[position] if position < len(codes) else None
+        if entry_code and entry_code not in extracted:
+            entry["code"] = entry.get("code") or entry_code
+            extracted[entry_code] = entry
+    return extracted
+
+def _extract_policies_json(codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Extract policy information for several codes, batching cache misses into shared LLM calls."""
+    if not llm or not _vectorstore:
         return {
-            "found": False,
-            "code": code,
-            "notes": f"Extraction error: {str(e)}"
+            code: {"found": False, "code": code, "notes": "Policy extraction disabled" if not settings.ENABLE_POLICY_EXTRACTION else "LLM or vectorstore not available"}
+            for code in codes
         }
 
+    doc_version = _policy_doc_version()
+    results: Dict[str, Dict[str, Any]] = {}
+    misses = []
+    for code in dict.fromkeys(codes):
+        cached = _policy_cache_lookup(code, doc_version)
+        if cached is not None:
+            # Decode per call so callers can modify the result without touching the cache
+            results[code] = json.loads(cached)
+        else:
+            misses.append(code)
+
+    pending = iter(misses)
+    while batch := list(itertools.islice(pending, POLICY_BATCH_SIZE)):
+        try:
+            extracted = _invoke_policy_llm_batch(batch)
+        except _PolicyExtractionError as e:
+            for code in batch:
+                results[code] = {"found": False, "code": code, **e.details}
+            continue
+        except Exception as e:
+            logger.error(f"Policy extraction failed for codes {batch}: {e}")
+            for code in batch:
+                results[code] = {"found": False, "code": code, "notes": f"Extraction error: {str(e)}"}
+            continue
+
+        for code in batch:
+            if code in extracted:
+                _policy_cache_store(code, doc_version, json.dumps(extracted[code]))
+                results[code] = extracted[code]
+            else:
+                results[code] = {"found": False, "code": code, "notes": "Code missing from LLM output"}
+    return results
+
+def _extract_policy_json(code: str) -> Dict[str, Any]:
+    """Extract policy information for a given code using LLM."""
+    return _extract_policies_json([code])[code]
+
 # --- MCP Tools ---
 
+_FIRST_KEYWORD_RE = re.compile(r"\s*(\w+)")
+
 @mcp.tool()
+@_run_in_executor
 def execute_query(query: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     Execute a SQL query against the claims database.
@@ -202,40 +468,53 @@ def execute_query(query: str, params: Optional[Dict[str, Any]] = None) -> str:
         params = {}
     
     start_time = time.perf_counter()
-    conn = get_db_connection()
+    # Only the leading keyword decides; no uppercased copy of the whole query is made
+    first_keyword = _FIRST_KEYWORD_RE.match(query)
+    is_select = first_keyword is not None and first_keyword.group(1).casefold() == "select"
     
     try:
-        cursor = conn.cursor()
-        logger.info(f"Executing query: {query[:200]}")
-        
-        # Convert dict params to tuple if needed for sqlite3
-        if isinstance(params, dict) and params:
-            cursor.execute(query, params)
-        elif isinstance(params, (list, tuple)):
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        # Handle SELECT vs DML operations
-        if query.strip().upper().startswith("SELECT"):
-            rows = cursor.fetchall()
-            data = [dict(row) for row in rows]
-            row_count = len(data)
-        else:
-            conn.commit()
-            data = None
-            row_count = cursor.rowcount
+        with db_cursor() as cursor, (nullcontext() if is_select else _db_write_lock):
+            logger.info(f"Executing query: {query[:200]}")
+            
+            # Convert dict params to tuple if needed for sqlite3
+            if isinstance(params, dict) and params:
+                cursor.execute(query, params)
+            elif isinstance(params, (list, tuple)):
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            
+            # Handle SELECT vs DML operations (DML is committed by autocommit mode)
+            if is_select:
+                # Encode rows one at a time straight into the response instead of
+                # materializing the full row list, the dict list and the JSON together
+                columns = [col[0] for col in cursor.description]
+                cursor.row_factory = None
+                out = io.StringIO()
+                out.write('{"success":true,"data":[')
+                row_count = 0
+                for row in cursor:
+                    if row_count:
+                        out.write(",")
+                    out.write(_dumps_compact(dict(zip(columns, row))))
+                    row_count += 1
+            else:
+                row_count = cursor.rowcount
 
         execution_time_ms = (time.perf_counter() - start_time) * 1000
         
+        if is_select:
+            out.write(f'],"execution_time_ms":{round(execution_time_ms, 2)},"row_count":{row_count}}}')
+            return out.getvalue()
+        
         result = {
             "success": True,
-            "data": data,
+            "data": None,
             "execution_time_ms": round(execution_time_ms, 2),
             "row_count": row_count
         }
         
-        return json.dumps(result, indent=2)
+        return _dumps(result)
         
     except sqlite3.Error as e:
         execution_time_ms = (time.perf_counter() - start_time) * 1000
@@ -247,12 +526,27 @@ def execute_query(query: str, params: Optional[Dict[str, Any]] = None) -> str:
             "execution_time_ms": round(execution_time_ms, 2)
         }
         
-        return json.dumps(result, indent=2)
-    finally:
-        if conn:
-            conn.close()
+        return _dumps(result)
+
+# Column order of the SOP queries below; rows are mapped to dicts positionally
+_SOP_COLS = ("id", "sop_code", "step_number", "description", "query")
+# Constant SQL text so sqlite3's per-connection statement cache reuses the prepared statement
+_SQL_ALL_SOPS = "SELECT id, sop_code, step_number, description, query FROM SOP ORDER BY sop_code, step_number"
+# Codes are matched case-insensitively, like the index and page queries; served by ix_sop_upper_code
+_SQL_SOP_BY_CODE = "SELECT id, sop_code, step_number, description, query FROM SOP WHERE UPPER(sop_code) = ? ORDER BY step_number"
+# Rows the per-SOP version hash is computed from (see build_sop_index)
+_SQL_SOP_INDEX = "SELECT sop_code, step_number, description, query FROM SOP ORDER BY UPPER(sop_code), step_number"
+_SOP_INDEX_COLS = ("sop_code", "step_number", "description", "query")
+# One page of whole SOPs (all their steps), keyset-paged by upper-cased code so a code's rows never span pages
+_SQL_SOPS_PAGE = (
+    "SELECT id, sop_code, step_number, description, query FROM SOP "
+    "WHERE UPPER(sop_code) IN ("
+    "SELECT DISTINCT UPPER(sop_code) FROM SOP WHERE UPPER(sop_code) > ? ORDER BY 1 LIMIT ?"
+    ") ORDER BY UPPER(sop_code), step_number"
+)
 
 @mcp.tool()
+@_run_in_executor
 def get_all_sops() -> str:
     """
     Retrieve all SOP steps from the database.
@@ -260,26 +554,12 @@ def get_all_sops() -> str:
     Returns:
         JSON string with all SOP steps ordered by code and step number
     """
-    conn = get_db_connection()
+    cursor = get_db_connection().cursor()
+    # Plain tuples are cheaper to build than sqlite3.Row and are zipped positionally below
+    cursor.row_factory = None
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, sop_code, step_number, description, query 
-            FROM SOP 
-            ORDER BY sop_code, step_number
-        """)
-        rows = cursor.fetchall()
-        
-        sops = []
-        for row in rows:
-            sop_step = {
-                "id": row["id"],
-                "sop_code": row["sop_code"],
-                "step_number": row["step_number"],
-                "description": row["description"],
-                "query": row["query"]
-            }
-            sops.append(sop_step)
+        cursor.execute(_SQL_ALL_SOPS)
+        sops = [dict(zip(_SOP_COLS, row)) for row in cursor.fetchall()]
         
         result = {
             "success": True,
@@ -287,7 +567,7 @@ def get_all_sops() -> str:
             "count": len(sops)
         }
         
-        return json.dumps(result, indent=2)
+        return _dumps(result)
         
     except sqlite3.Error as e:
         logger.error(f"Error retrieving all SOPs: {e}")
@@ -295,12 +575,82 @@ def get_all_sops() -> str:
             "success": False,
             "error": str(e)
         }
-        return json.dumps(result, indent=2)
+        return _dumps(result)
     finally:
-        if conn:
-            conn.close()
+        cursor.close()
 
 @mcp.tool()
+@_run_in_executor
+def get_sops_page(after_sop_code: str = "", limit: int = 100) -> str:
+    """
+    Retrieve the steps of up to `limit` SOP codes that sort after `after_sop_code`.
+    
+    Args:
+        after_sop_code: Upper-cased SOP code of the previous page's last SOP ("" for the first page)
+        limit: Maximum number of SOP codes in the page
+    
+    Returns:
+        JSON string with the page's SOP steps ordered by upper-cased code and step number
+    """
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None
+    try:
+        cursor.execute(_SQL_SOPS_PAGE, (after_sop_code.upper(), limit))
+        sops = [dict(zip(_SOP_COLS, row)) for row in cursor.fetchall()]
+        
+        result = {
+            "success": True,
+            "data": sops,
+            "count": len(sops)
+        }
+        
+        return _dumps(result)
+        
+    except sqlite3.Error as e:
+        logger.error(f"Error retrieving SOP page after {after_sop_code!r}: {e}")
+        result = {
+            "success": False,
+            "error": str(e)
+        }
+        return _dumps(result)
+    finally:
+        cursor.close()
+
+@mcp.tool()
+@_run_in_executor
+def get_sop_index() -> str:
+    """
+    Retrieve one row per SOP code with its step count and a hash of its steps' content.
+    
+    Returns:
+        JSON string with the SOP index, suitable for detecting changed SOPs
+    """
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None
+    try:
+        cursor.execute(_SQL_SOP_INDEX)
+        index = build_sop_index(dict(zip(_SOP_INDEX_COLS, row)) for row in cursor.fetchall())
+        
+        result = {
+            "success": True,
+            "data": index,
+            "count": len(index)
+        }
+        
+        return _dumps(result)
+        
+    except sqlite3.Error as e:
+        logger.error(f"Error retrieving SOP index: {e}")
+        result = {
+            "success": False,
+            "error": str(e)
+        }
+        return _dumps(result)
+    finally:
+        cursor.close()
+
+@mcp.tool()
+@_run_in_executor
 def get_sop_by_code(sop_code: str) -> str:
     """
     Retrieve all steps for a specific SOP code.
@@ -311,35 +661,18 @@ def get_sop_by_code(sop_code: str) -> str:
     Returns:
         JSON string with SOP steps for the specified code
     """
-    conn = get_db_connection()
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, sop_code, step_number, description, query 
-            FROM SOP 
-            WHERE sop_code = ? 
-            ORDER BY step_number
-        """, (sop_code.upper(),))
+        cursor.execute(_SQL_SOP_BY_CODE, (sop_code.upper(),))
+        sops = [dict(zip(_SOP_COLS, row)) for row in cursor.fetchall()]
         
-        rows = cursor.fetchall()
-        
-        if not rows:
+        if not sops:
             result = {
                 "success": False,
                 "error": f"SOP code '{sop_code}' not found"
             }
-            return json.dumps(result, indent=2)
-        
-        sops = []
-        for row in rows:
-            sop_step = {
-                "id": row["id"],
-                "sop_code": row["sop_code"],
-                "step_number": row["step_number"],
-                "description": row["description"],
-                "query": row["query"]
-            }
-            sops.append(sop_step)
+            return _dumps(result)
         
         result = {
             "success": True,
@@ -348,7 +681,7 @@ def get_sop_by_code(sop_code: str) -> str:
             "sop_code": sop_code.upper()
         }
         
-        return json.dumps(result, indent=2)
+        return _dumps(result)
         
     except sqlite3.Error as e:
         logger.error(f"Error retrieving SOP {sop_code}: {e}")
@@ -356,23 +689,23 @@ def get_sop_by_code(sop_code: str) -> str:
             "success": False,
             "error": str(e)
         }
-        return json.dumps(result, indent=2)
+        return _dumps(result)
     finally:
-        if conn:
-            conn.close()
+        cursor.close()
 
-@mcp.tool()
-def get_database_schema() -> str:
-    """
-    Get the database schema information.
-    
-    Returns:
-        JSON string with table schema information
-    """
-    conn = get_db_connection()
+def _schema_mtime_ns() -> int:
+    """Latest modification time of the database, including its WAL where DDL lands first."""
+    wal_path = DATABASE_PATH.with_name(DATABASE_PATH.name + "-wal")
+    mtimes = [DATABASE_PATH.stat().st_mtime_ns]
+    if wal_path.exists():
+        mtimes.append(wal_path.stat().st_mtime_ns)
+    return max(mtimes)
+
+@functools.lru_cache(maxsize=1)
+def _schema_cache(db_mtime_ns: int) -> str:
+    """Build the schema JSON; cached until the database file changes (keyed on its mtime)."""
+    cursor = get_db_connection().cursor()
     try:
-        cursor = conn.cursor()
-        
         # Get table names
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = [row[0] for row in cursor.fetchall()]
@@ -399,20 +732,59 @@ def get_database_schema() -> str:
             "tables": tables
         }
         
-        return json.dumps(result, indent=2)
+        return _dumps(result)
+    finally:
+        cursor.close()
+
+@mcp.tool()
+@_run_in_executor
+def get_database_schema() -> str:
+    """
+    Get the database schema information.
+    
+    Returns:
+        JSON string with table schema information
+    """
+    try:
+        return _schema_cache(_schema_mtime_ns())
         
-    except sqlite3.Error as e:
+    except (sqlite3.Error, OSError) as e:
         logger.error(f"Error retrieving schema: {e}")
         result = {
             "success": False,
             "error": str(e)
         }
-        return json.dumps(result, indent=2)
-    finally:
-        if conn:
-            conn.close()
+        return _dumps(result)
+
+# "Name (code)" entry of a place-of-service list; the code is the last parenthesised group
+_POS_RE = re.compile(r"\s*(.*?)\s*\(\s*([^()]*?)\s*\)\s*")
+
+def _format_policy_result(result: Dict[str, Any], code: str, fields: Optional[List[str]]) -> Dict[str, Any]:
+    """Normalize place_of_service and apply the optional field filter to an extraction result."""
+    # Normalize place_of_service if returned as string
+    pos = result.get("possible_place_of_service")
+    if isinstance(pos, str) and pos:
+        items = []
+        for token in pos.split(","):
+            match = _POS_RE.fullmatch(token)
+            if match:
+                items.append({"name": match.group(1), "code": match.group(2)})
+            else:
+                items.append({"name": token.strip(), "code": ""})
+        result["possible_place_of_service"] = items
+    
+    # Filter fields if requested
+    if fields:
+        filtered = {k: result.get(k) for k in fields}
+        # Always include essential fields
+        filtered["found"] = result.get("found", False)
+        filtered["code"] = result.get("code", code)
+        return filtered
+    
+    return result
 
 @mcp.tool()
+@_run_in_executor
 def extract_policy_json_by_code(code: str, fields: Optional[List[str]] = None) -> str:
     """
     Extract medical policy information for a specific procedure code.
@@ -425,30 +797,27 @@ def extract_policy_json_by_code(code: str, fields: Optional[List[str]] = None) -
         JSON string with extracted policy information
     """
     result = _extract_policy_json(code)
+    return _dumps(_format_policy_result(result, code, fields))
+
+@mcp.tool()
+@_run_in_executor
+def extract_policies_json_by_codes(codes: List[str], fields: Optional[List[str]] = None) -> str:
+    """
+    Extract medical policy information for several procedure codes at once.
     
-    # Normalize place_of_service if returned as string
-    pos = result.get("possible_place_of_service")
-    if isinstance(pos, str) and pos:
-        items = []
-        for token in pos.split(","):
-            token = token.strip()
-            if "(" in token and token.endswith(")"):
-                name = token[:token.rfind("(")].strip()
-                code_val = token[token.rfind("(")+1:-1].strip()
-                items.append({"name": name, "code": code_val})
-            else:
-                items.append({"name": token, "code": ""})
-        result["possible_place_of_service"] = items
+    Codes are sent to the LLM in batches, so the policy document is only
+    included once per batch instead of once per code.
     
-    # Filter fields if requested
-    if fields:
-        filtered = {k: result.get(k) for k in fields}
-        # Always include essential fields
-        filtered["found"] = result.get("found", False)
-        filtered["code"] = result.get("code", code)
-        return json.dumps(filtered, indent=2)
+    Args:
+        codes: List of 5-digit procedure codes (e.g., ['27447', '29881'])
+        fields: Optional list of specific fields to return for each code
     
-    return json.dumps(result, indent=2)
+    Returns:
+        JSON string with a "results" list holding one entry per requested code, in order
+    """
+    extracted = _extract_policies_json(codes)
+    results = [_format_policy_result(extracted[code], code, fields) for code in codes]
+    return _dumps({"results": results})
 
 if __name__ == "__main__":
     # Initialize and run the server
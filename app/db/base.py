@@ -1,17 +1,97 @@
 """Base database models and session management."""
+import functools
+import json
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from typing import TYPE_CHECKING, AsyncIterator
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 from ..config.settings import settings
 
-# Create database engine
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
+_IS_SQLITE = "sqlite" in settings.DATABASE_URL
+
+def _json_serializer(obj) -> str:
+    """Encode JSON columns, with orjson unless disabled in settings; unknown types become str."""
+    if orjson is not None and settings.JSON_USE_ORJSON:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=str)
+
+_json_deserializer = orjson.loads if orjson is not None else json.loads
+
+_IS_IN_MEMORY = _IS_SQLITE and (":memory:" in settings.DATABASE_URL or settings.DATABASE_URL.rstrip("/") == "sqlite:")
+
+def _pool_options() -> dict:
+    """Pool arguments shared by the sync and async engines (each uses its default queue pool)."""
+    if _IS_IN_MEMORY:
+        # Every connection to an in-memory database is a new, empty database; share one
+        return {"poolclass": StaticPool}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+# Create database engine; pooled connections are reused instead of reopened per session
 engine = create_engine(
     settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
-    echo=settings.DEBUG
+    connect_args={"check_same_thread": False} if _IS_SQLITE else {},
+    echo=settings.DEBUG,
+    **_pool_options(),
+    query_cache_size=1200,
+    json_serializer=_json_serializer,
+    json_deserializer=_json_deserializer,
 )
 
+if _IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Configure each new SQLite connection once, when the pool opens it."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    # Lookup indexes for databases built by the standalone scripts (their SOP table has no
+    # (sop_code, step_number) constraint) or before the index was added to the model;
+    # claim_lines is already covered by its primary key
+    _SQLITE_INDEXES = (
+        "CREATE INDEX IF NOT EXISTS ix_sop_code_step ON SOP(sop_code, step_number)",
+        "CREATE INDEX IF NOT EXISTS ix_cpl_icn_id_desc ON claims_processed_lines(icn, id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_sop_results_icn_sop_step ON sop_results(icn, sop_code, step_number)",
+        "CREATE INDEX IF NOT EXISTS ix_cps_icn_step ON claim_processing_steps(icn, step_number)",
+        "CREATE INDEX IF NOT EXISTS ix_cl_icn_cond ON claim_lines(icn, condition_code) WHERE condition_code IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_cl_cond_icn ON claim_lines(condition_code, icn) WHERE condition_code IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_sop_upper_code ON SOP(UPPER(sop_code), step_number)",
+    )
+
+    @event.listens_for(engine, "first_connect")
+    def _ensure_sqlite_indexes(dbapi_connection, connection_record):
+        """Create missing lookup indexes once per process, on the engine's first connection."""
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in _SQLITE_INDEXES:
+                try:
+                    cursor.execute(statement)
+                except dbapi_connection.OperationalError:
+                    # Table not created yet; create_all will add the model's own constraint
+                    continue
+            dbapi_connection.commit()
+        finally:
+            cursor.close()
+
 # Create a scoped session factory
 SessionLocal = scoped_session(
     sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -22,9 +102,56 @@ Base = declarative_base()
 
 @contextmanager
 def get_db():
-    """Dependency for getting database session."""
+    """Dependency for getting database session.
+    
+    The block is one transaction: it commits when the block exits normally and
+    rolls back if it raises, so CRUD helpers may flush without committing.
+    """
     db = SessionLocal()
     try:
         yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     finally:
+        # Return the connection to the pool and drop the thread-local session
         db.close()
+        SessionLocal.remove()
+
+
+def _async_database_url(url: str) -> str:
+    """Map the configured sync URL onto its asyncio driver."""
+    if url.startswith("sqlite:///"):
+        return url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+@functools.lru_cache(maxsize=1)
+def get_async_sessionmaker() -> "async_sessionmaker":
+    """Create the asyncio engine on first use, so sync-only callers never import its driver."""
+    # Imported here: the asyncio extension needs greenlet, which sync-only callers can skip
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        _async_database_url(settings.DATABASE_URL),
+        echo=settings.DEBUG,
+        **_pool_options(),
+        query_cache_size=1200,
+        json_serializer=_json_serializer,
+        json_deserializer=_json_deserializer,
+    )
+    if _IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return async_sessionmaker(async_engine, expire_on_commit=False)
+
+async def get_async_db() -> AsyncIterator["AsyncSession"]:
+    """FastAPI dependency yielding an AsyncSession, so endpoints do not block the event loop."""
+    async with get_async_sessionmaker()() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
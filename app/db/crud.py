@@ -1,13 +1,156 @@
 """Database CRUD operations for claims processing."""
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-import json
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Tuple, Iterable, Iterator
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, or_, select, bindparam, func, insert, cast, Text
+from sqlalchemy.dialects.postgresql import distinct_on
 
 from ..models.claims import ClaimHeader, ClaimLine, SOPResult, ClaimProcessedLine, ClaimProcessingStep
 from ..models.sops import SOP
 from ..config.logging_config import logger
 
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+# Statements built once with bound parameters, so every call hits SQLAlchemy's compiled cache
+_SEL_HEADER = select(ClaimHeader).where(ClaimHeader.icn == bindparam("icn"))
+_SEL_HEADER_ROW = select(ClaimHeader.__table__).where(ClaimHeader.icn == bindparam("icn"))
+_SEL_LINES = select(ClaimLine).where(ClaimLine.icn == bindparam("icn")).order_by(ClaimLine.line_no)
+_SEL_LINE_ROWS = select(ClaimLine.__table__).where(ClaimLine.icn == bindparam("icn")).order_by(ClaimLine.line_no)
+# Served by the partial (icn, condition_code) index: already ordered and NULL-free, no sort
+_SEL_CONDITION_CODES = select(ClaimLine.condition_code).where(
+    ClaimLine.icn == bindparam("icn"),
+    ClaimLine.condition_code.isnot(None)
+).distinct()
+# Condition codes of many claims in one pass over the same partial index
+_SEL_ALL_CONDITION_CODES = select(ClaimLine.icn, ClaimLine.condition_code).where(
+    ClaimLine.condition_code.isnot(None)
+).distinct().order_by(ClaimLine.icn, ClaimLine.condition_code)
+_SEL_CONDITION_CODES_FOR_ICNS = _SEL_ALL_CONDITION_CODES.where(
+    ClaimLine.icn.in_(bindparam("icns", expanding=True))
+)
+# Claims having any of the given condition codes, served by the (condition_code, icn) index
+_SEL_MATCHING_CONDITION_CODES = select(ClaimLine.icn, ClaimLine.condition_code).where(
+    ClaimLine.condition_code.in_(bindparam("codes", expanding=True))
+).distinct().order_by(ClaimLine.icn, ClaimLine.condition_code)
+_SEL_HEADERS_FOR_ICNS = select(ClaimHeader.__table__).where(
+    ClaimHeader.icn.in_(bindparam("icns", expanding=True))
+).order_by(ClaimHeader.icn)
+_SEL_LINES_FOR_ICNS = select(ClaimLine.__table__).where(
+    ClaimLine.icn.in_(bindparam("icns", expanding=True))
+).order_by(ClaimLine.icn, ClaimLine.line_no)
+# Keeps each IN list well under SQLite's bound-parameter limit
+CONDITION_CODES_CHUNK_SIZE = 500
+_SEL_SOP_RESULTS = select(SOPResult).where(SOPResult.icn == bindparam("icn")).order_by(SOPResult.step_number)
+_SEL_SOP_RESULTS_BY_CODE = select(SOPResult).where(
+    SOPResult.icn == bindparam("icn"),
+    SOPResult.sop_code == bindparam("sop_code")
+).order_by(SOPResult.step_number)
+_SEL_PROCESSING_STEPS = select(ClaimProcessingStep).where(
+    ClaimProcessingStep.icn == bindparam("icn")
+).order_by(ClaimProcessingStep.step_number)
+# Same rows with data left as its stored JSON text, for callers that only display it
+_SEL_PROCESSING_STEP_ROWS = select(
+    *(c for c in ClaimProcessingStep.__table__.c if c.key != "data"),
+    cast(ClaimProcessingStep.data, Text).label("data")
+).where(
+    ClaimProcessingStep.icn == bindparam("icn")
+).order_by(ClaimProcessingStep.step_number)
+
+# Latest processed row per ICN: DISTINCT ON where supported, else ROW_NUMBER() over the
+# (icn, id DESC) index; either way a single ordered pass instead of aggregate + self-join
+_SEL_LATEST_PROCESSED_DISTINCT_ON = select(ClaimProcessedLine).ext(distinct_on(ClaimProcessedLine.icn)).order_by(
+    ClaimProcessedLine.icn, ClaimProcessedLine.id.desc()
+)
+_ranked_processed = select(
+    ClaimProcessedLine,
+    func.row_number().over(
+        partition_by=ClaimProcessedLine.icn,
+        order_by=ClaimProcessedLine.id.desc()
+    ).label("rn")
+).subquery()
+_latest_processed = aliased(ClaimProcessedLine, _ranked_processed)
+_SEL_LATEST_PROCESSED = select(_latest_processed).where(_ranked_processed.c.rn == 1)
+# Latest processed row per ICN joined to its claim header, for the batch grid. Only the
+# displayed columns are projected, so the processing_results JSON is never read.
+_GRID_COLUMNS = (
+    ClaimHeader.icn.label("header_icn"),
+    ClaimHeader.member_name,
+    ClaimHeader.provider_name,
+)
+_SEL_GRID_ROWS_DISTINCT_ON = select(
+    ClaimProcessedLine.icn, ClaimProcessedLine.sop_code, ClaimProcessedLine.decision, *_GRID_COLUMNS
+).outerjoin(ClaimHeader, ClaimHeader.icn == ClaimProcessedLine.icn).ext(distinct_on(ClaimProcessedLine.icn)).order_by(
+    ClaimProcessedLine.icn, ClaimProcessedLine.id.desc()
+)
+_ranked_grid = select(
+    ClaimProcessedLine.icn,
+    ClaimProcessedLine.sop_code,
+    ClaimProcessedLine.decision,
+    func.row_number().over(
+        partition_by=ClaimProcessedLine.icn,
+        order_by=ClaimProcessedLine.id.desc()
+    ).label("rn")
+).subquery()
+_SEL_GRID_ROWS = select(
+    _ranked_grid.c.icn, _ranked_grid.c.sop_code, _ranked_grid.c.decision, *_GRID_COLUMNS
+).outerjoin(ClaimHeader, ClaimHeader.icn == _ranked_grid.c.icn).where(_ranked_grid.c.rn == 1).order_by(
+    _ranked_grid.c.icn
+)
+_SEL_PROCESSED_ICN_COUNT = select(func.count(ClaimProcessedLine.icn.distinct()))
+
+# Decision columns only, so the processing_results JSON is not read or decoded.
+# Ordered by id to match the plain .first() lookup it replaces.
+_SEL_CLAIM_DECISION = select(ClaimProcessedLine.decision, ClaimProcessedLine.decision_reason).where(
+    ClaimProcessedLine.icn == bindparam("icn")
+).order_by(ClaimProcessedLine.id).limit(1)
+
+# Change token for one claim's processed results: any new decision or step row bumps a MAX(id)
+_SEL_CLAIM_RESULTS_VERSION = select(
+    select(func.max(ClaimProcessedLine.id)).where(ClaimProcessedLine.icn == bindparam("icn")).scalar_subquery(),
+    select(func.max(ClaimProcessingStep.id)).where(ClaimProcessingStep.icn == bindparam("icn")).scalar_subquery(),
+)
+
+# Cheap change token for the processed claims table: any insert bumps MAX(id), any delete COUNT(*)
+_SEL_PROCESSED_VERSION = select(func.count(), func.max(ClaimProcessedLine.id))
+
+# Short-lived cache of get_claim_with_lines results keyed by ICN; the UI re-reads the same
+# claim repeatedly while it is being processed
+CLAIM_CACHE_SIZE = 1024
+CLAIM_CACHE_TTL_SECONDS = 60.0
+_claim_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_claim_cache_lock = threading.RLock()
+
+def _copy_claim(claim: Dict[str, Any]) -> Dict[str, Any]:
+    # Copies the header and every line dict, so a caller's edits cannot reach the cached entry
+    return {**claim, 'claim_lines': [dict(line) for line in claim['claim_lines']]}
+
+def _claim_cache_get(icn: str) -> Optional[Dict[str, Any]]:
+    with _claim_cache_lock:
+        entry = _claim_cache.get(icn)
+        if entry is None:
+            return None
+        expires_at, claim = entry
+        if expires_at < time.monotonic():
+            del _claim_cache[icn]
+            return None
+        _claim_cache.move_to_end(icn)
+    return _copy_claim(claim)
+
+def _claim_cache_put(icn: str, claim: Dict[str, Any]) -> None:
+    with _claim_cache_lock:
+        _claim_cache[icn] = (time.monotonic() + CLAIM_CACHE_TTL_SECONDS, claim)
+        _claim_cache.move_to_end(icn)
+        if len(_claim_cache) > CLAIM_CACHE_SIZE:
+            _claim_cache.popitem(last=False)
+
+def invalidate_claim_cache(icn: str) -> None:
+    """Drop a cached claim so the next read goes to the database."""
+    with _claim_cache_lock:
+        _claim_cache.pop(icn, None)
+
 class ClaimCRUD:
     """CRUD operations for claim data."""
     
@@ -15,7 +158,7 @@ class ClaimCRUD:
     def get_claim_header(db: Session, icn: str) -> Optional[ClaimHeader]:
         """Retrieve a claim header by ICN."""
         try:
-            return db.query(ClaimHeader).filter(ClaimHeader.icn == icn).first()
+            return db.execute(_SEL_HEADER, {"icn": icn}).scalars().first()
         except Exception as e:
             logger.error(f"Error getting claim header for ICN {icn}: {e}")
             raise
@@ -24,24 +167,58 @@ class ClaimCRUD:
     def get_claim_lines(db: Session, icn: str) -> List[ClaimLine]:
         """Retrieve all claim lines for a given ICN."""
         try:
-            return db.query(ClaimLine).filter(ClaimLine.icn == icn).order_by(ClaimLine.line_no).all()
+            return db.execute(_SEL_LINES, {"icn": icn}).scalars().all()
         except Exception as e:
             logger.error(f"Error getting claim lines for ICN {icn}: {e}")
             raise
     
     @staticmethod
-    def get_claim_with_lines(db: Session, icn: str) -> Dict[str, Any]:
-        """Retrieve a claim with all its lines as a dictionary."""
+    def get_claim_lines_raw(db: Session, icn: str) -> List[Dict[str, Any]]:
+        """Retrieve all claim lines for a given ICN as plain dicts, skipping ORM instances."""
+        try:
+            rows = db.execute(_SEL_LINE_ROWS, {"icn": icn}).mappings().all()
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting raw claim lines for ICN {icn}: {e}")
+            raise
+    
+    @staticmethod
+    def get_claim_with_lines(db: Session, icn: str, cache: bool = True) -> Dict[str, Any]:
+        """Retrieve a claim with all its lines as a dictionary.
+        
+        Results are cached per ICN for a short TTL; pass cache=False to force a read.
+        """
+        if cache:
+            cached = _claim_cache_get(icn)
+            if cached is not None:
+                return cached
         try:
-            claim = ClaimCRUD.get_claim_header(db, icn)
-            if not claim:
+            # Core selects return rows straight as mappings; no ORM instances are built
+            header = db.execute(_SEL_HEADER_ROW, {"icn": icn}).mappings().first()
+            if not header:
                 return None
                 
-            claim_dict = {c.name: getattr(claim, c.name) for c in claim.__table__.columns}
-            claim_dict['claim_lines'] = [
-                {c.name: getattr(line, c.name) for c in ClaimLine.__table__.columns}
-                for line in ClaimCRUD.get_claim_lines(db, icn)
-            ]
+            claim_dict = dict(header)
+            claim_dict['claim_lines'] = ClaimCRUD.get_claim_lines_raw(db, icn)
+            if cache:
+                _claim_cache_put(icn, claim_dict)
+                return _copy_claim(claim_dict)
+            return claim_dict
+        except Exception as e:
+            logger.error(f"Error getting claim with lines for ICN {icn}: {e}")
+            raise
+    
+    @staticmethod
+    async def aget_claim_with_lines(db: "AsyncSession", icn: str) -> Optional[Dict[str, Any]]:
+        """Async variant of get_claim_with_lines for asyncio callers such as the API."""
+        try:
+            header = (await db.execute(_SEL_HEADER_ROW, {"icn": icn})).mappings().first()
+            if not header:
+                return None
+            
+            claim_dict = dict(header)
+            lines = (await db.execute(_SEL_LINE_ROWS, {"icn": icn})).mappings().all()
+            claim_dict['claim_lines'] = [dict(row) for row in lines]
             return claim_dict
         except Exception as e:
             logger.error(f"Error getting claim with lines for ICN {icn}: {e}")
@@ -51,33 +228,117 @@ class ClaimCRUD:
     def get_all_claims_with_details(db: Session) -> List[Dict[str, Any]]:
         """Retrieve all claims with their lines."""
         try:
-            claims = db.query(ClaimHeader).all()
-            claim_list = []
-            for claim in claims:
-                claim_dict = {c.name: getattr(claim, c.name) for c in claim.__table__.columns}
-                claim_dict['claim_lines'] = [
-                    {c.name: getattr(line, c.name) for c in ClaimLine.__table__.columns}
-                    for line in ClaimCRUD.get_claim_lines(db, claim.icn)
-                ]
-                claim_list.append(claim_dict)
+            # Two Core selects (headers, then every line in claim order) instead of ORM
+            # instances whose columns would be copied out one attribute at a time
+            claim_list = [dict(header) for header in db.execute(select(ClaimHeader.__table__)).mappings()]
+            lines_by_icn: Dict[str, List[Dict[str, Any]]] = {claim['icn']: [] for claim in claim_list}
+            for line in db.execute(
+                select(ClaimLine.__table__).order_by(ClaimLine.icn, ClaimLine.line_no)
+            ).mappings():
+                lines_by_icn.setdefault(line['icn'], []).append(dict(line))
+            for claim_dict in claim_list:
+                claim_dict['claim_lines'] = lines_by_icn[claim_dict['icn']]
             return claim_list
         except Exception as e:
             logger.error(f"Error getting all claims with details: {e}")
             raise
     
+    @staticmethod
+    def iter_claims_with_details(db: Session, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Yield claims with their lines, holding only one batch of headers in memory.
+        
+        Headers are streamed with yield_per (a server-side cursor where the driver
+        supports one) and each batch's lines are fetched with a single IN query.
+        """
+        try:
+            headers = db.execute(
+                select(ClaimHeader.__table__)
+                .order_by(ClaimHeader.icn)
+                .execution_options(yield_per=batch_size)
+            ).mappings()
+            for partition in headers.partitions():
+                claims = [dict(header) for header in partition]
+                lines_by_icn: Dict[str, List[Dict[str, Any]]] = {claim['icn']: [] for claim in claims}
+                for line in db.execute(
+                    select(ClaimLine.__table__)
+                    .where(ClaimLine.icn.in_(list(lines_by_icn)))
+                    .order_by(ClaimLine.icn, ClaimLine.line_no)
+                ).mappings():
+                    lines_by_icn[line['icn']].append(dict(line))
+                for claim_dict in claims:
+                    claim_dict['claim_lines'] = lines_by_icn[claim_dict['icn']]
+                    yield claim_dict
+        except Exception as e:
+            logger.error(f"Error streaming claims with details: {e}")
+            raise
+    
+    @staticmethod
+    def get_claims_with_matching_sops(db: Session, sop_codes: Iterable[str]) -> List[Dict[str, Any]]:
+        """Retrieve the claims (with their lines) that have a condition code among sop_codes.
+
+        The match is done in SQL, so claims without a matching code are never
+        loaded. Each claim carries its matching codes under 'matching_sops'.
+        """
+        codes = list(sop_codes)
+        if not codes:
+            return []
+        try:
+            matching_by_icn: Dict[str, List[str]] = {}
+            for icn, code in db.execute(_SEL_MATCHING_CONDITION_CODES, {"codes": codes}):
+                matching_by_icn.setdefault(icn, []).append(code)
+
+            icns = list(matching_by_icn)
+            claims: List[Dict[str, Any]] = []
+            for i in range(0, len(icns), CONDITION_CODES_CHUNK_SIZE):
+                chunk = {"icns": icns[i:i + CONDITION_CODES_CHUNK_SIZE]}
+                chunk_claims = [dict(header) for header in db.execute(_SEL_HEADERS_FOR_ICNS, chunk).mappings()]
+                lines_by_icn: Dict[str, List[Dict[str, Any]]] = {claim['icn']: [] for claim in chunk_claims}
+                for line in db.execute(_SEL_LINES_FOR_ICNS, chunk).mappings():
+                    lines_by_icn[line['icn']].append(dict(line))
+                for claim_dict in chunk_claims:
+                    claim_dict['claim_lines'] = lines_by_icn[claim_dict['icn']]
+                    claim_dict['matching_sops'] = matching_by_icn[claim_dict['icn']]
+                claims.extend(chunk_claims)
+            return claims
+        except Exception as e:
+            logger.error(f"Error getting claims with matching SOPs: {e}")
+            raise
+
     @staticmethod
     def get_condition_codes(db: Session, icn: str) -> List[str]:
         """Get all unique condition codes for a claim."""
         try:
-            result = db.query(ClaimLine.condition_code).filter(
-                ClaimLine.icn == icn,
-                ClaimLine.condition_code.isnot(None)
-            ).distinct().all()
-            return [r[0] for r in result if r[0]]
+            result = db.execute(_SEL_CONDITION_CODES, {"icn": icn}).scalars().all()
+            return [code for code in result if code]
         except Exception as e:
             logger.error(f"Error getting condition codes for ICN {icn}: {e}")
             raise
     
+    @staticmethod
+    def get_condition_codes_bulk(db: Session, icns: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        """Get the unique condition codes of many claims at once, keyed by ICN.
+
+        With icns=None the codes of every claim are returned. ICNs without
+        condition codes are absent from the result.
+        """
+        codes_by_icn: Dict[str, List[str]] = {}
+        try:
+            if icns is None:
+                batches = [db.execute(_SEL_ALL_CONDITION_CODES)]
+            else:
+                batches = (
+                    db.execute(_SEL_CONDITION_CODES_FOR_ICNS, {"icns": icns[i:i + CONDITION_CODES_CHUNK_SIZE]})
+                    for i in range(0, len(icns), CONDITION_CODES_CHUNK_SIZE)
+                )
+            for result in batches:
+                for icn, code in result:
+                    if code:
+                        codes_by_icn.setdefault(icn, []).append(code)
+            return codes_by_icn
+        except Exception as e:
+            logger.error(f"Error getting condition codes in bulk: {e}")
+            raise
+
     @staticmethod
     def create_sop_result(
         db: Session,
@@ -89,7 +350,10 @@ class ClaimCRUD:
         result_data: Optional[Dict] = None,
         error_message: Optional[str] = None
     ) -> SOPResult:
-        """Create a new SOP processing result."""
+        """Create a new SOP processing result.
+        
+        Participates in the caller's transaction: the row is flushed, not committed.
+        """
         try:
             result = SOPResult(
                 icn=icn,
@@ -97,15 +361,16 @@ class ClaimCRUD:
                 step_number=step_number,
                 step_name=step_name,
                 status=status,
-                result_data=str(result_data) if result_data else None,
+                result_data=result_data,
                 error_message=error_message
             )
             db.add(result)
-            db.commit()
-            db.refresh(result)
+            # Flush assigns the primary key; the caller's get_db() block commits once
+            db.flush()
+            invalidate_claim_cache(icn)
             return result
         except Exception as e:
-            db.rollback()
+            # No rollback here: get_db() rolls back the caller's whole transaction on raise
             logger.error(f"Error creating SOP result for ICN {icn}, SOP {sop_code}: {e}")
             raise
     
@@ -117,10 +382,9 @@ class ClaimCRUD:
     ) -> List[SOPResult]:
         """Get all SOP results for a claim, optionally filtered by SOP code."""
         try:
-            query = db.query(SOPResult).filter(SOPResult.icn == icn)
             if sop_code:
-                query = query.filter(SOPResult.sop_code == sop_code)
-            return query.order_by(SOPResult.step_number).all()
+                return db.execute(_SEL_SOP_RESULTS_BY_CODE, {"icn": icn, "sop_code": sop_code}).scalars().all()
+            return db.execute(_SEL_SOP_RESULTS, {"icn": icn}).scalars().all()
         except Exception as e:
             logger.error(f"Error getting SOP results for ICN {icn}: {e}")
             raise
@@ -134,12 +398,13 @@ class ClaimCRUD:
                 sop_code=sop_code,
                 decision=decision,
                 decision_reason=decision_reason,
-                processing_results=json.dumps(processing_results, default=str)
+                processing_results=processing_results
             )
             db.add(processed_line)
             db.commit()
             db.refresh(processed_line)
             logger.info(f"Saved processed result for ICN {icn} to the database.")
+            invalidate_claim_cache(icn)
             return processed_line
         except Exception as e:
             db.rollback()
@@ -150,56 +415,134 @@ class ClaimCRUD:
     def get_all_processed_claims(db: Session) -> List[ClaimProcessedLine]:
         """Retrieve all processed claims, ensuring only the most recent entry for each ICN."""
         try:
-            # Subquery to find the latest processed_at for each icn
-            from sqlalchemy import func
-            subquery = db.query(
-                ClaimProcessedLine.icn,
-                func.max(ClaimProcessedLine.id).label('max_id')
-            ).group_by(ClaimProcessedLine.icn).subquery()
-
-            # Join the original table with the subquery to get the full record of the latest entry
-            return db.query(ClaimProcessedLine).join(
-                subquery,
-                and_(
-                    ClaimProcessedLine.icn == subquery.c.icn,
-                    ClaimProcessedLine.id == subquery.c.max_id
-                )
-            ).all()
+            if db.get_bind().dialect.name == "postgresql":
+                return db.execute(_SEL_LATEST_PROCESSED_DISTINCT_ON).scalars().all()
+            return db.execute(_SEL_LATEST_PROCESSED).scalars().all()
         except Exception as e:
             logger.error(f"Error getting all processed claims: {e}")
             raise
 
+    @staticmethod
+    def get_processed_claims_with_headers(db: Session, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """Latest processed row per ICN with the claim's member and provider names, in one query.
+
+        Rows are ordered by ICN; pass limit/offset to fetch a single page. Each row
+        has icn, sop_code, decision, member_name and provider_name; header_icn is
+        None when the claim header no longer exists.
+        """
+        try:
+            stmt = _SEL_GRID_ROWS_DISTINCT_ON if db.get_bind().dialect.name == "postgresql" else _SEL_GRID_ROWS
+            if limit is not None:
+                # LIMIT/OFFSET are rendered as bound parameters, so the compiled statement is still cached
+                stmt = stmt.limit(limit).offset(offset)
+            return db.execute(stmt).mappings().all()
+        except Exception as e:
+            logger.error(f"Error getting processed claims with headers: {e}")
+            raise
+
+    @staticmethod
+    def count_processed_claims(db: Session) -> int:
+        """Count the distinct ICNs that have been processed."""
+        try:
+            return db.execute(_SEL_PROCESSED_ICN_COUNT).scalar_one()
+        except Exception as e:
+            logger.error(f"Error counting processed claims: {e}")
+            raise
+
+    @staticmethod
+    def get_claim_decision(db: Session, icn: str) -> Optional[Dict[str, Any]]:
+        """Return the decision and decision_reason stored for an ICN, or None if it was never processed."""
+        try:
+            return db.execute(_SEL_CLAIM_DECISION, {"icn": icn}).mappings().first()
+        except Exception as e:
+            logger.error(f"Error getting decision for ICN {icn}: {e}")
+            raise
+
+    @staticmethod
+    def get_claim_results_version(db: Session, icn: str) -> str:
+        """Return a token that changes whenever a decision or processing step is stored for the ICN."""
+        try:
+            processed_id, step_id = db.execute(_SEL_CLAIM_RESULTS_VERSION, {"icn": icn}).one()
+            return f"{processed_id}:{step_id}"
+        except Exception as e:
+            logger.error(f"Error getting results version for ICN {icn}: {e}")
+            raise
+
+    @staticmethod
+    def get_processed_claims_version(db: Session) -> str:
+        """Return a token that changes whenever processed claims are added or removed."""
+        try:
+            count, max_id = db.execute(_SEL_PROCESSED_VERSION).one()
+            return f"{count}:{max_id}"
+        except Exception as e:
+            logger.error(f"Error getting processed claims version: {e}")
+            raise
+
+    @staticmethod
+    def _processing_step_row(icn: str, sop_code: str, step_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Map a workflow step result onto claim_processing_steps column values."""
+        return {
+            "icn": icn,
+            "sop_code": sop_code,
+            "step_number": step_data.get("step_number"),
+            "description": step_data.get("description"),
+            "status": step_data.get("status"),
+            "timestamp": step_data.get("timestamp"),
+            "query": step_data.get("query"),
+            "data": step_data.get("data"),
+            "row_count": step_data.get("row_count"),
+            "execution_time_ms": step_data.get("execution_time_ms"),
+            "error": step_data.get("error"),
+        }
+
     @staticmethod
     def create_claim_processing_step(db: Session, icn: str, sop_code: str, step_data: Dict[str, Any]) -> ClaimProcessingStep:
-        """Create a new claim processing step."""
+        """Create a new claim processing step.
+        
+        Participates in the caller's transaction: the row is flushed, not committed.
+        Deprecated: use create_claim_processing_steps_bulk for a whole claim.
+        """
         try:
-            step = ClaimProcessingStep(
-                icn=icn,
-                sop_code=sop_code,
-                step_number=step_data.get("step_number"),
-                description=step_data.get("description"),
-                status=step_data.get("status"),
-                timestamp=step_data.get("timestamp"),
-                query=step_data.get("query"),
-                data=json.dumps(step_data.get("data"), default=str),
-                row_count=step_data.get("row_count"),
-                execution_time_ms=step_data.get("execution_time_ms"),
-                error=step_data.get("error")
-            )
+            step = ClaimProcessingStep(**ClaimCRUD._processing_step_row(icn, sop_code, step_data))
             db.add(step)
-            db.commit()
-            db.refresh(step)
+            db.flush()
+            invalidate_claim_cache(icn)
             return step
         except Exception as e:
-            db.rollback()
+            # No rollback here: get_db() rolls back the caller's whole transaction on raise
             logger.error(f"Error creating claim processing step for ICN {icn}: {e}")
             raise
 
+    @staticmethod
+    def create_claim_processing_steps_bulk(db: Session, icn: str, sop_code: str, steps: List[Dict[str, Any]]) -> int:
+        """Insert all processing steps of a claim with a single executemany and commit."""
+        if not steps:
+            return 0
+        try:
+            rows = [ClaimCRUD._processing_step_row(icn, sop_code, step_data) for step_data in steps]
+            db.execute(insert(ClaimProcessingStep), rows)
+            db.commit()
+            invalidate_claim_cache(icn)
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error creating claim processing steps for ICN {icn}: {e}")
+            raise
+
     @staticmethod
     def get_claim_processing_steps(db: Session, icn: str) -> List[ClaimProcessingStep]:
         """Retrieve all processing steps for a given ICN."""
         try:
-            return db.query(ClaimProcessingStep).filter(ClaimProcessingStep.icn == icn).order_by(ClaimProcessingStep.step_number).all()
+            return db.execute(_SEL_PROCESSING_STEPS, {"icn": icn}).scalars().all()
+        except Exception as e:
+            logger.error(f"Error getting claim processing steps for ICN {icn}: {e}")
+            raise
+
+    @staticmethod
+    def get_claim_processing_step_rows(db: Session, icn: str) -> List[Dict[str, Any]]:
+        """Retrieve all processing steps for a given ICN as row mappings, with data as undecoded JSON text."""
+        try:
+            return db.execute(_SEL_PROCESSING_STEP_ROWS, {"icn": icn}).mappings().all()
         except Exception as e:
             logger.error(f"Error getting claim processing steps for ICN {icn}: {e}")
             raise
@@ -250,4 +593,41 @@ class SOPCRUD:
             logger.error(f"Error creating/updating SOP for SOP Code {sop_code}: {e}")
             raise
 
+    @staticmethod
+    def create_sops_bulk(db: Session, rows: List[Dict[str, Any]]) -> int:
+        """Create or update many SOP steps in a single transaction.
+
+        Each row needs sop_code, step_number, description and query. Existing
+        (sop_code, step_number) pairs are updated in place, like create_sop.
+        """
+        if not rows:
+            return 0
+        try:
+            sop_codes = {row["sop_code"] for row in rows}
+            existing_ids = {
+                (code, step): sop_id
+                for sop_id, code, step in db.query(SOP.id, SOP.sop_code, SOP.step_number)
+                .filter(SOP.sop_code.in_(sop_codes))
+            }
+
+            inserts, updates = [], []
+            for row in rows:
+                sop_id = existing_ids.get((row["sop_code"], row["step_number"]))
+                if sop_id is None:
+                    inserts.append(row)
+                else:
+                    updates.append({**row, "id": sop_id})
+
+            if inserts:
+                db.bulk_insert_mappings(SOP, inserts)
+            if updates:
+                db.bulk_update_mappings(SOP, updates)
+            db.commit()
+            logger.info(f"Bulk loaded SOP steps: {len(inserts)} created, {len(updates)} updated")
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error bulk loading SOP steps: {e}")
+            raise
+
 sop_crud = SOPCRUD()
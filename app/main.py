@@ -3,19 +3,49 @@ import uvicorn
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
 from pathlib import Path
+import json
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows: no flock; create_all is idempotent, so just run it
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
 # Import application components
-from .config.settings import settings
-from .db.base import Base, engine, get_db
+from .config.settings import settings, ensure_app_dirs
+from .db.base import engine, get_async_db
+from .db.crud import crud
 from .db.init_db import init_db, clear_db
 from .sops.loader import sop_loader
 from .config.logging_config import logger
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+def create_tables():
+    """Create missing tables at startup instead of on import.
+    
+    Workers starting together take a file lock in turn, so none serves requests
+    before the tables exist; create_all is idempotent, so later workers only
+    pay for its existence checks.
+    """
+    ensure_app_dirs()
+    with open(settings.DATA_DIR / ".create_all.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        init_db()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the tables before the app starts serving requests."""
+    create_tables()
+    yield
 
 # Initialize the FastAPI application
 app = FastAPI(
@@ -23,7 +53,8 @@ app = FastAPI(
     description="API for processing and analyzing pending claims using SOPs",
     version=settings.VERSION,
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -38,23 +69,48 @@ app.add_middleware(
 # Mount static files for the Streamlit UI
 app.mount("/static", StaticFiles(directory=settings.BASE_DIR / "app" / "ui" / "static"), name="static")
 
-# Health check endpoint
+def _json_bytes(obj) -> bytes:
+    """Encode obj as compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+def _ndjson_line(obj) -> bytes:
+    """Encode one NDJSON record."""
+    return _json_bytes(obj) + b"\n"
+
+
+# Health check endpoint; the payload never changes at runtime, so it is encoded once
+_HEALTH_BYTES = _json_bytes({
+    "status": "ok",
+    "version": settings.VERSION,
+    "environment": "development"
+})
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint."""
-    return {
-        "status": "ok",
-        "version": settings.VERSION,
-        "environment": "development"
-    }
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 # API endpoints
+@app.get("/api/claims")
+def list_claims():
+    """Stream all claims with their lines as NDJSON, one claim per line."""
+    
+    def generate():
+        # Starlette may resume the generator on any threadpool thread, so it owns a
+        # plain Session rather than the thread-scoped one get_db() hands out
+        with Session(engine) as db:
+            for claim in crud.iter_claims_with_details(db):
+                yield _ndjson_line(claim)
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @app.get("/api/claims/{icn}")
-async def get_claim(icn: str, db=Depends(get_db)):
+async def get_claim(icn: str, db=Depends(get_async_db)):
     """Get claim details by ICN."""
-    from .db.crud import crud
     
-    claim = crud.get_claim_with_lines(db, icn)
+    claim = await crud.aget_claim_with_lines(db, icn)
     if not claim:
         raise HTTPException(status_code=404, detail=f"Claim with ICN {icn} not found")
     
@@ -63,20 +119,23 @@ async def get_claim(icn: str, db=Depends(get_db)):
 @app.get("/api/sops/{sop_code}")
 async def get_sop(sop_code: str):
     """Get SOP definition by code."""
-    sop = sop_loader.get_sop(sop_code)
+    # Async lookup: the sync loader would block this loop on a nested MCP round trip
+    sop = await sop_loader.get_sop_dict_async(sop_code)
     if not sop:
         raise HTTPException(status_code=404, detail=f"SOP {sop_code} not found")
     
-    return JSONResponse(content=sop.dict())
+    return JSONResponse(content=sop)
 
 # Initialize the application
 def init_app():
     """Initialize the application."""
+    ensure_app_dirs()
+    
     # Initialize the database
     init_db()
     
-    # Load all SOPs
-    sop_loader.load_all()
+    # Load the SOP index; definitions are fetched on first use
+    sop_loader.load_index()
     
     logger.info("Application initialized")
 
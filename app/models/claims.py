@@ -1,11 +1,16 @@
 """Database models for claims processing."""
 from datetime import date
-from sqlalchemy import Column, String, Integer, Float, Date, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, Float, Date, ForeignKey, Text, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 from ..db.base import Base
 
+# JSON payload columns: JSONB on PostgreSQL, JSON (stored as text) elsewhere; the driver
+# layer encodes and decodes them, so callers pass and receive plain Python objects
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 class ClaimHeader(Base):
     """Claim header information (one per claim)."""
     __tablename__ = 'claim_headers'
@@ -24,7 +29,12 @@ class ClaimHeader(Base):
     primary_dx_code = Column(String, nullable=True, comment='Primary diagnosis code')
     
     # Relationship to claim lines
-    claim_lines = relationship("ClaimLine", back_populates="header", cascade="all, delete-orphan")
+    claim_lines = relationship(
+        "ClaimLine",
+        back_populates="header",
+        cascade="all, delete-orphan",
+        order_by="ClaimLine.line_no",
+    )
     
     def __repr__(self):
         return f"<ClaimHeader(icn={self.icn}, member={self.member_name}, provider={self.provider_name})>"
@@ -52,6 +62,21 @@ class ClaimLine(Base):
     
     # Relationship to claim header
     header = relationship("ClaimHeader", back_populates="claim_lines")
+
+    __table_args__ = (
+        # get_condition_codes: DISTINCT condition_code WHERE icn = ? AND condition_code IS NOT NULL
+        Index(
+            'ix_cl_icn_cond', 'icn', 'condition_code',
+            postgresql_where=condition_code.isnot(None),
+            sqlite_where=condition_code.isnot(None),
+        ),
+        # get_claims_with_matching_sops: condition_code IN (...) -> ICNs
+        Index(
+            'ix_cl_cond_icn', 'condition_code', 'icn',
+            postgresql_where=condition_code.isnot(None),
+            sqlite_where=condition_code.isnot(None),
+        ),
+    )
     
     def __repr__(self):
         return f"<ClaimLine(icn={self.icn}, line={self.line_no}, procedure={self.procedure_code})>"
@@ -67,9 +92,14 @@ class SOPResult(Base):
     step_number = Column(Integer, nullable=False, comment='Step number in the SOP')
     step_name = Column(String, nullable=False, comment='Name/description of the step')
     status = Column(String, nullable=False, comment='Status: pending, success, failed')
-    result_data = Column(Text, nullable=True, comment='JSON string of result data')
+    result_data = Column(JSONType, nullable=True, comment='JSON result data')
     error_message = Column(Text, nullable=True, comment='Error message if step failed')
     created_at = Column(String, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        # get_sop_results: WHERE icn = ? [AND sop_code = ?] ORDER BY step_number
+        Index('ix_sop_results_icn_sop_step', 'icn', 'sop_code', 'step_number'),
+    )
     
     def __repr__(self):
         return f"<SOPResult(icn={self.icn}, sop={self.sop_code}, step={self.step_number}, status={self.status})>"
@@ -85,7 +115,12 @@ class ClaimProcessedLine(Base):
     decision = Column(String, nullable=True, comment='Final decision (e.g., APPROVE, DENY, PEND)')
     decision_reason = Column(Text, nullable=True, comment='Reason for the decision')
     processed_at = Column(String, server_default=func.now(), nullable=False)
-    processing_results = Column(Text, nullable=True, comment='Full JSON output from the claim processing workflow')
+    processing_results = Column(JSONType, nullable=True, comment='Full JSON output from the claim processing workflow')
+
+    __table_args__ = (
+        # Serves the latest-row-per-ICN lookup in get_all_processed_claims
+        Index('ix_cpl_icn_id_desc', 'icn', id.desc(), postgresql_include=['decision', 'decision_reason']),
+    )
 
     def __repr__(self):
         return f"<ClaimProcessedLine(icn={self.icn}, decision={self.decision}, sop_code={self.sop_code})>"
@@ -103,10 +138,15 @@ class ClaimProcessingStep(Base):
     status = Column(String, nullable=False, comment='Status of the step (e.g., completed, failed)')
     timestamp = Column(String, nullable=False, comment='Timestamp of the step execution')
     query = Column(Text, nullable=True, comment='SQL query executed in the step')
-    data = Column(Text, nullable=True, comment='JSON string of the data returned by the query')
+    data = Column(JSONType, nullable=True, comment='JSON data returned by the query')
     row_count = Column(Integer, nullable=True, comment='Number of rows returned by the query')
     execution_time_ms = Column(Float, nullable=True, comment='Execution time of the query in milliseconds')
     error = Column(Text, nullable=True, comment='Error message if the step failed')
 
+    __table_args__ = (
+        # get_claim_processing_steps: WHERE icn = ? ORDER BY step_number
+        Index('ix_cps_icn_step', 'icn', 'step_number'),
+    )
+
     def __repr__(self):
         return f"<ClaimProcessingStep(icn={self.icn}, sop_code={self.sop_code}, step={self.step_number})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Text, UniqueConstraint
+from sqlalchemy import Column, String, Integer, Text, UniqueConstraint, Index, func
 from ..db.base import Base
 
 class SOP(Base):
@@ -13,6 +13,8 @@ class SOP(Base):
 
     __table_args__ = (
         UniqueConstraint('sop_code', 'step_number', name='uq_sop_code_step'),
+        # MCP SOP lookups match and order codes case-insensitively: UPPER(sop_code) = ?
+        Index('ix_sop_upper_code', func.upper(sop_code), 'step_number'),
     )
 
     def __repr__(self):
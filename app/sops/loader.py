@@ -1,142 +1,452 @@
 """Loader for Standard Operating Procedure (SOP) definitions (via MCP)."""
 import asyncio
-from collections import defaultdict
-from typing import Dict, TypeVar, Any, Optional, List
+import json
+import operator
+import os
+import threading
+import time
+import weakref
+from typing import Dict, FrozenSet, TypeVar, Any, Optional, List, Set, Tuple
 
-from .models import SOPDefinition, SOPStep
+from .models import SOPDefinition, SOPStep, sop_rows_version
 from app.config.logging_config import logger
+from app.config.settings import settings
 
 # Import the MCP LangChain client you already implemented
-from app.core.mcp_client import mcp_langchain_client 
+from app.core.mcp_client import get_mcp_langchain_client
 
 T = TypeVar('T', bound='SOPStep')
 
+# Steps are sorted after construction, when step_number is already a coerced int
+_step_key = operator.attrgetter("step_number")
+
+# Last known SOP definitions, used when MCP is unavailable at startup
+SOP_CACHE_PATH = settings.DATA_DIR / "sop_cache.json"
+
+
+# One private event loop per thread for sync callers; reusing it keeps loop-bound
+# MCP sessions alive between calls. Streamlit runs each session on its own thread.
+_thread_loops = threading.local()
+# Running loops already patched by nest_asyncio
+_nested_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
 
-def _ensure_event_loop():
-    """Get or create an event loop for sync contexts."""
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_closed():
-            raise RuntimeError
-        return loop
-    except Exception:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop
+
+def _get_thread_loop() -> asyncio.AbstractEventLoop:
+    loop = getattr(_thread_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _thread_loops.loop = asyncio.new_event_loop()
+    return loop
 
 
 def _run_async(coro):
     """Run an async coroutine from sync code safely."""
     try:
-        # Try to use nest_asyncio if available (for Jupyter/Streamlit environments)
-        import nest_asyncio
-        nest_asyncio.apply()
-        loop = _ensure_event_loop()
-        return loop.run_until_complete(coro)
-    except ImportError:
-        # Fallback to regular asyncio handling
-        loop = _ensure_event_loop()
-        if loop.is_running():
-            # If already in an async context, the caller must be async; re-raise for clarity
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No loop running in this thread: the common case, no patching needed
+        return _get_thread_loop().run_until_complete(coro)
+
+    # Called from inside a running loop (e.g. a Streamlit page under asyncio.run);
+    # re-entering it needs nest_asyncio, applied once per loop.
+    if loop not in _nested_loops:
+        try:
+            import nest_asyncio
+        except ImportError:
+            coro.close()
             raise RuntimeError("SOPLoader called from an active event loop; use async methods instead.")
-        return loop.run_until_complete(coro)
+        nest_asyncio.apply(loop)
+        _nested_loops.add(loop)
+    return loop.run_until_complete(coro)
 
 
 class SOPLoader:
-    """Loads and validates SOP definitions from the MCP-backed database."""
+    """Loads and validates SOP definitions from the MCP-backed database.
+
+    Definitions are fetched per SOP on first use and kept in process. A compact
+    index of ``{sop_code: version}`` (step count and highest row id) is used to
+    spot changed SOPs; stale entries keep being served while they are refreshed
+    in the background. ``load_all`` remains available to warm every SOP at once.
+    """
 
     def __init__(self):
         """Initialize the SOP loader."""
         self._sop_definitions: Dict[str, SOPDefinition] = {}
+        # Serialized definitions for API responses; rebuilt whenever the definitions are reloaded
+        self._sop_dicts: Dict[str, Dict[str, Any]] = {}
+        # Codes in the index, rebuilt on first use after the index changes
+        self._sop_codes: Optional[FrozenSet[str]] = None
+        # Version of each SOP in the database, and of each definition held above
+        self._index: Dict[str, str] = {}
+        self._mtime: Dict[str, str] = {}
+        self._index_loaded_at = 0.0
+        # Keys of running background refreshes, and strong references to their tasks
+        self._refreshing: Set[str] = set()
+        self._refresh_tasks: Set[asyncio.Task] = set()
 
-    async def _fetch_all_sops(self) -> Dict[str, SOPDefinition]:
-        """Fetch all SOPs from MCP and build SOPDefinition dictionary."""
-        logger.info("SOPLoader: Fetching SOPs from MCP database.")
-        result = await mcp_langchain_client.get_all_sops()
-        if not result.success:
-            msg = f"Failed to fetch SOPs from MCP: {result.error}"
-            logger.error(msg)
-            raise RuntimeError(msg)
+    @staticmethod
+    def _build_definition(code: str, steps_rows: List[Dict[str, Any]]) -> Optional[SOPDefinition]:
+        """Build an SOPDefinition from the step rows of one SOP code."""
+        # Rows come from our own SOP table, so build the models without
+        # re-running pydantic validation on every field. Each row is touched once:
+        # step_number is coerced (missing -> 0) and NaN queries cleared in this pass.
+        steps: List[SOPStep] = []
+        for sr in steps_rows:
+            query_val = sr.get("query")
+            # Replace NaN with None, as NaN is not a valid Pydantic string
+            if isinstance(query_val, float) and query_val != query_val:
+                query_val = None
 
-        rows = result.data or []
-        # Expecting columns: id, sop_code, step_number, description, query
-        grouped: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-        for r in rows:
-            code = (r.get("sop_code") or "").upper()
-            if not code:
-                logger.warning(f"SOP row missing sop_code: {r}")
-                continue
-            grouped[code].append(r)
+            steps.append(SOPStep.model_construct(
+                step_number=int(sr.get("step_number") or 0),
+                description=sr.get("description") or "",
+                query=query_val,
+            ))
+
+        # Sort by step_number (already ordered by the MCP queries, so this is a single pass)
+        steps.sort(key=_step_key)
 
+        # Same invariant as SOPDefinition.validate_steps_not_empty
+        if not steps:
+            return None
+
+        return SOPDefinition.model_construct(
+            sop_code=code,
+            steps=steps,
+            entry_point=steps[0].step_number,
+            version="1.0.0",
+            description=None,
+        )
+
+    @staticmethod
+    def _rows_version(steps_rows: List[Dict[str, Any]]) -> str:
+        """Version of an SOP computed from its rows; matches the index built by get_sop_index."""
+        return sop_rows_version(steps_rows)
+
+    async def _fetch_all_sops(self) -> Tuple[Dict[str, SOPDefinition], Dict[str, str]]:
+        """Fetch all SOPs from MCP and build SOPDefinition and version dictionaries."""
+        logger.info("SOPLoader: Fetching SOPs from MCP database.")
         sop_defs: Dict[str, SOPDefinition] = {}
+        versions: Dict[str, str] = {}
 
-        for code, steps_rows in grouped.items():
-            # Sort by step_number
-            steps_rows.sort(key=lambda x: x.get("step_number", 0))
-
-            # Map DB rows to SOPStep model
-            steps: List[SOPStep] = []
-            for sr in steps_rows:
-                try:
-                    query_val = sr.get("query")
-                    # Replace NaN with None, as NaN is not a valid Pydantic string
-                    if isinstance(query_val, float) and query_val != query_val:
-                        query_val = None
-
-                    step = SOPStep(
-                        step_number=sr.get("step_number"),
-                        description=sr.get("description"),
-                        query=query_val,
-                    )
-                    steps.append(step)
-                except Exception as e:
-                    logger.error(f"Error creating SOPStep for {code}: {e}", exc_info=True)
-
-            # Build SOPDefinition.
-            try:
-                sop_def = SOPDefinition(
-                    sop_code=code,
-                    steps=steps,
-                )
+        def build(code: str, steps_rows: List[Dict[str, Any]]) -> None:
+            sop_def = self._build_definition(code, steps_rows)
+            if sop_def is not None:
                 sop_defs[code] = sop_def
-            except Exception as e:
-                logger.error(f"Error creating SOPDefinition for {code}: {e}", exc_info=True)
+                versions[code] = self._rows_version(steps_rows)
+
+        # Rows stream in ordered by upper-cased code, so each SOP is built as soon as
+        # the next code starts and its raw rows are released right away.
+        # Expecting columns: id, sop_code, step_number, description, query
+        current_code: Optional[str] = None
+        current_rows: List[Dict[str, Any]] = []
+        try:
+            async for r in get_mcp_langchain_client().stream_all_sops():
+                code = (r.get("sop_code") or "").upper()
+                if not code:
+                    logger.warning(f"SOP row missing sop_code: {r}")
+                    continue
+                if code != current_code:
+                    if current_rows:
+                        build(current_code, current_rows)
+                    current_code, current_rows = code, []
+                current_rows.append(r)
+        except RuntimeError as e:
+            logger.error(str(e))
+            raise
+        if current_rows:
+            build(current_code, current_rows)
 
         logger.info(f"SOPLoader: Loaded {len(sop_defs)} SOP definitions from MCP.")
-        return sop_defs
+        return sop_defs, versions
+
+    async def _fetch_sop(self, code: str) -> Optional[Tuple[SOPDefinition, str]]:
+        """Fetch a single SOP from MCP; returns None when it does not exist."""
+        result = await get_mcp_langchain_client().get_sop_by_code(code)
+        if not result.success or not result.data:
+            logger.warning(f"SOPLoader: SOP {code} not available from MCP: {result.error}")
+            return None
+        sop_def = self._build_definition(code, list(result.data))
+        if sop_def is None:
+            return None
+        return sop_def, self._rows_version(result.data)
+
+    async def _fetch_index(self) -> Dict[str, str]:
+        """Fetch the {sop_code: version} index from MCP."""
+        result = await get_mcp_langchain_client().get_sop_index()
+        if not result.success:
+            raise RuntimeError(f"Failed to fetch SOP index from MCP: {result.error}")
+        return {
+            (r.get("sop_code") or "").upper(): r.get("version")
+            for r in result.data or []
+            if r.get("sop_code")
+        }
+
+    def _store(self, code: str, sop_def: SOPDefinition, version: str) -> None:
+        self._sop_definitions[code] = sop_def
+        self._mtime[code] = version
+        self._sop_dicts.pop(code, None)
+
+    def _drop(self, code: str) -> None:
+        self._sop_definitions.pop(code, None)
+        self._mtime.pop(code, None)
+        self._sop_dicts.pop(code, None)
+
+    def _set_index(self, index: Dict[str, str]) -> None:
+        self._index = index
+        self._sop_codes = None
+        self._index_loaded_at = time.monotonic()
+
+    def _index_expired(self) -> bool:
+        return time.monotonic() - self._index_loaded_at > settings.SOP_INDEX_TTL_SECONDS
+
+    def _install_all(self, sop_defs: Dict[str, SOPDefinition], versions: Dict[str, str]) -> None:
+        self._sop_definitions = sop_defs
+        self._mtime = versions
+        self._sop_dicts.clear()
+        self._set_index(dict(versions))
+        self._save_disk_cache()
+
+    def _save_disk_cache(self) -> None:
+        """Persist the cached definitions so a cold start can run without MCP."""
+        payload = {
+            code: {"version": self._mtime.get(code), "sop": sop.model_dump()}
+            for code, sop in self._sop_definitions.items()
+        }
+        tmp_path = SOP_CACHE_PATH.with_suffix(".tmp")
+        try:
+            SOP_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, SOP_CACHE_PATH)
+        except OSError as e:
+            logger.warning(f"SOPLoader: could not write {SOP_CACHE_PATH}: {e}")
+
+    def _load_disk_cache(self) -> bool:
+        """Seed the in-process cache from the last persisted definitions."""
+        try:
+            with open(SOP_CACHE_PATH, encoding="utf-8") as f:
+                payload = json.load(f)
+            sop_defs = {code: SOPDefinition.model_validate(entry["sop"]) for code, entry in payload.items()}
+            versions = {code: entry.get("version") for code, entry in payload.items()}
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"SOPLoader: ignoring unreadable {SOP_CACHE_PATH}: {e}")
+            return False
+        self._sop_definitions = sop_defs
+        self._mtime = versions
+        self._sop_dicts.clear()
+        # Expired at once, so the index is re-checked as soon as MCP is reachable
+        self._index = dict(versions)
+        self._sop_codes = None
+        self._index_loaded_at = time.monotonic() - settings.SOP_INDEX_TTL_SECONDS - 1
+        logger.info(f"SOPLoader: Loaded {len(sop_defs)} SOP definitions from {SOP_CACHE_PATH}.")
+        return True
+
+    def _fallback_to_disk(self) -> None:
+        if not self._load_disk_cache():
+            self._sop_definitions = {}
 
     def load_all(self) -> Dict[str, SOPDefinition]:
         """Load all SOP definitions from MCP and cache them."""
         try:
-            self._sop_definitions = _run_async(self._fetch_all_sops())
+            self._install_all(*_run_async(self._fetch_all_sops()))
         except Exception as e:
             logger.error(f"SOPLoader.load_all failed: {e}", exc_info=True)
-            self._sop_definitions = {}
+            self._fallback_to_disk()
         return self._sop_definitions
 
     async def load_all_async(self) -> Dict[str, SOPDefinition]:
         """Async variant to load all SOP definitions from MCP."""
         try:
-            self._sop_definitions = await self._fetch_all_sops()
+            self._install_all(*await self._fetch_all_sops())
         except Exception as e:
             logger.error(f"SOPLoader.load_all_async failed: {e}", exc_info=True)
-            self._sop_definitions = {}
+            self._fallback_to_disk()
         return self._sop_definitions
 
+    def load_index(self) -> Dict[str, str]:
+        """Load only the SOP index; definitions are fetched when first requested."""
+        try:
+            self._set_index(_run_async(self._fetch_index()))
+        except Exception as e:
+            logger.error(f"SOPLoader.load_index failed: {e}", exc_info=True)
+            self._load_disk_cache()
+        return self._index
+
+    async def load_index_async(self) -> Dict[str, str]:
+        """Async variant to load only the SOP index."""
+        try:
+            self._set_index(await self._fetch_index())
+        except Exception as e:
+            logger.error(f"SOPLoader.load_index_async failed: {e}", exc_info=True)
+            self._load_disk_cache()
+        return self._index
+
+    def _lookup(self, sop_code: str) -> Tuple[str, Optional[SOPDefinition]]:
+        """Return the normalized code and its cached definition, if any.
+
+        Keys are upper case and callers nearly always pass upper-case codes, so
+        the code is tried as given before paying for .upper().
+        """
+        sop = self._sop_definitions.get(sop_code)
+        if sop is not None:
+            return sop_code, sop
+        code = sop_code.upper()
+        return code, self._sop_definitions.get(code)
+
+    def sop_codes(self) -> FrozenSet[str]:
+        """Return the code of every SOP in the database, per the index.
+
+        The index is re-loaded once its TTL expires, so SOPs added elsewhere
+        show up and a failed load is retried on the next call.
+        """
+        if not self._index_loaded_at or self._index_expired():
+            self.load_index()
+        if self._sop_codes is None:
+            self._sop_codes = frozenset(self._index)
+        return self._sop_codes
+
     def get_sop(self, sop_code: str) -> Optional[SOPDefinition]:
-        """Get an SOP definition by its code."""
-        if not self._sop_definitions:
-            self.load_all()
-        return self._sop_definitions.get(sop_code.upper())
+        """Get an SOP definition by its code, fetching just that SOP on a miss."""
+        code, sop = self._lookup(sop_code)
+        if sop is not None:
+            return sop
+        if not self._index_loaded_at or self._index_expired():
+            self.load_index()
+        if code not in self._index:
+            return None
+        try:
+            fetched = _run_async(self._fetch_sop(code))
+        except Exception as e:
+            logger.error(f"SOPLoader.get_sop failed for {code}: {e}", exc_info=True)
+            return None
+        if fetched is None:
+            return None
+        self._store(code, *fetched)
+        self._save_disk_cache()
+        return fetched[0]
+
+    def get_sop_dict(self, sop_code: str) -> Optional[Dict[str, Any]]:
+        """Get an SOP definition as a plain dict, serialized once per load."""
+        # Same as _lookup: keys are upper case, so try the code as given first
+        code = sop_code
+        cached = self._sop_dicts.get(code)
+        if cached is None:
+            code = sop_code.upper()
+            cached = self._sop_dicts.get(code)
+        if cached is None:
+            sop = self.get_sop(code)
+            if sop is None:
+                return None
+            cached = self._sop_dicts[code] = sop.model_dump()
+        return cached
 
     async def get_sop_async(self, sop_code: str) -> Optional[SOPDefinition]:
-        """Async variant to get an SOP definition by its code."""
-        if not self._sop_definitions:
-            await self.load_all_async()
-        return self._sop_definitions.get(sop_code.upper())
+        """Async variant to get an SOP definition by its code.
+
+        Cached definitions are returned immediately; if the index is due for a
+        re-check or shows a newer version, the refresh runs in the background.
+        """
+        code, sop = self._lookup(sop_code)
+        if sop is not None:
+            self._revalidate(code)
+            return sop
+
+        if not self._index_loaded_at or self._index_expired():
+            await self.load_index_async()
+        sop = await self._load_one(code)
+        if sop is not None:
+            self._save_disk_cache()
+        return sop
+
+    async def get_sop_dict_async(self, sop_code: str) -> Optional[Dict[str, Any]]:
+        """Async variant of get_sop_dict, for callers already on an event loop."""
+        sop = await self.get_sop_async(sop_code)
+        if sop is None:
+            return None
+        code, _ = self._lookup(sop_code)
+        cached = self._sop_dicts.get(code)
+        if cached is None:
+            cached = self._sop_dicts[code] = sop.model_dump()
+        return cached
+
+    async def get_sops_async(self, sop_codes: List[str]) -> Dict[str, SOPDefinition]:
+        """Get several SOP definitions at once, fetching all misses concurrently.
+
+        Returns the definitions found, keyed by upper-case code.
+        """
+        codes = {code.upper() for code in sop_codes}
+        found = {code: self._sop_definitions[code] for code in codes if code in self._sop_definitions}
+        for code in found:
+            self._revalidate(code)
+        misses = [code for code in codes if code not in found]
+        if not misses:
+            return found
+
+        if not self._index_loaded_at or self._index_expired():
+            await self.load_index_async()
+        results = await asyncio.gather(*(self._load_one(code) for code in misses))
+        for code, sop in zip(misses, results):
+            if sop is not None:
+                found[code] = sop
+        if any(sop is not None for sop in results):
+            self._save_disk_cache()
+        return found
+
+    async def _load_one(self, code: str) -> Optional[SOPDefinition]:
+        """Fetch and cache one SOP that is in the index but not yet loaded."""
+        if code not in self._index:
+            return None
+        try:
+            fetched = await self._fetch_sop(code)
+        except Exception as e:
+            logger.error(f"SOPLoader failed to fetch SOP {code}: {e}", exc_info=True)
+            return None
+        if fetched is None:
+            return None
+        self._store(code, *fetched)
+        return fetched[0]
+
+    def _revalidate(self, code: str) -> None:
+        """Schedule a background refresh if the index or a cached SOP is stale."""
+        if self._index_expired():
+            self._schedule_refresh("*", self._refresh_index())
+        elif self._index.get(code, self._mtime.get(code)) != self._mtime.get(code):
+            self._schedule_refresh(code, self._refresh_sop(code))
+
+    def _schedule_refresh(self, key: str, coro) -> None:
+        """Run a refresh coroutine in the background, at most one per key."""
+        if key in self._refreshing:
+            coro.close()
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(coro)
+        self._refresh_tasks.add(task)
+
+        def _done(t: asyncio.Task) -> None:
+            self._refreshing.discard(key)
+            self._refresh_tasks.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                logger.warning(f"SOPLoader: background refresh of {key} failed: {t.exception()}")
+
+        task.add_done_callback(_done)
 
-    
+    async def _refresh_sop(self, code: str) -> None:
+        # On a failed fetch the stale definition is kept and retried on a later request
+        fetched = await self._fetch_sop(code)
+        if fetched is not None:
+            self._store(code, *fetched)
+            self._save_disk_cache()
 
+    async def _refresh_index(self) -> None:
+        self._set_index(await self._fetch_index())
+        for code in [c for c in self._mtime if c not in self._index]:
+            self._drop(code)
+        changed = [code for code, version in self._mtime.items() if self._index[code] != version]
+        for code in changed:
+            await self._refresh_sop(code)
+        self._save_disk_cache()
 
     def reload(self) -> Dict[str, SOPDefinition]:
         """Reload all SOP definitions from MCP."""
@@ -1,11 +1,16 @@
 """Models for Standard Operating Procedures (SOPs) aligned with DB schema."""
 
-from typing import List, Optional
-from pydantic import BaseModel, Field, validator
+import hashlib
+import itertools
+import json
+from typing import Any, Dict, Iterable, List, Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class SOPStep(BaseModel):
     """Single SOP step corresponding to a row in the SOP table."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     step_number: int = Field(..., description="Sequential step number")
     description: str = Field(..., description="Detailed description of the step")
     query: Optional[str] = Field(
@@ -16,6 +21,8 @@ class SOPStep(BaseModel):
 
 class SOPDefinition(BaseModel):
     """Definition of a Standard Operating Procedure constructed from step rows."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     sop_code: str = Field(..., description="Unique identifier for the SOP (e.g., B007, F027)")
     steps: List[SOPStep] = Field(..., description="Ordered list of steps for the SOP")
     # Entry point for the workflow engine. For numeric step flows, this is typically the first step_number.
@@ -28,18 +35,36 @@ class SOPDefinition(BaseModel):
     version: str = Field("1.0.0", description="Version of the SOP")
     description: Optional[str] = Field(None, description="Optional long description of the SOP")
 
-    @validator("steps")
-    def validate_steps_not_empty(cls, v: List[SOPStep]):
-        if not v:
+    @model_validator(mode="after")
+    def validate_steps(self):
+        """Require at least one step and an entry_point that names one of them."""
+        if not self.steps:
             raise ValueError("SOP must contain at least one step")
-        return v
-
-    @validator("entry_point")
-    def validate_entry_point_in_steps(cls, v: int, values):
-        steps: List[SOPStep] = values.get("steps", [])
-        if steps and v not in {s.step_number for s in steps}:
+        # Only an explicitly set entry_point is checked; the default is left as is
+        if "entry_point" in self.model_fields_set and self.entry_point not in {s.step_number for s in self.steps}:
             # If an explicit entry_point is set but not present in steps, default to the first step_number.
             # This keeps compatibility with loaders that set entry_point=1 by default.
-            first_step = steps[0].step_number
-            return first_step
-        return v
+            # The model is frozen, so bypass the pydantic __setattr__ guard.
+            object.__setattr__(self, "entry_point", self.steps[0].step_number)
+        return self
+
+
+def sop_rows_version(steps_rows: Iterable[Dict[str, Any]]) -> str:
+    """Version of one SOP: a hash over the step numbers, descriptions and queries of its rows.
+
+    Rows edited in place (same code and step number) change the version too.
+    """
+    content = sorted(
+        (int(r.get("step_number") or 0), r.get("description") or "", r.get("query") or "")
+        for r in steps_rows
+    )
+    return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def build_sop_index(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reduce SOP rows ordered by upper-cased code to one {sop_code, step_count, version} entry per code."""
+    index = []
+    for code, code_rows in itertools.groupby(rows, key=lambda r: (r.get("sop_code") or "").upper()):
+        code_rows = list(code_rows)
+        index.append({"sop_code": code, "step_count": len(code_rows), "version": sop_rows_version(code_rows)})
+    return index
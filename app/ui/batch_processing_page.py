@@ -1,41 +1,30 @@
 import streamlit as st
 import pandas as pd
-from typing import Dict, Any, List, Optional
-import math
+from typing import Dict, Any, FrozenSet, List, Optional
 import json
 import asyncio
 
 from ..db.base import get_db
 from ..db.crud import crud
-from ..models.claims import ClaimProcessedLine
 from ..workflows.claim_processor import ClaimProcessor
 from ..sops.loader import sop_loader
+from ..config.settings import settings
 from ..config.logging_config import logger
 
+def _available_sop_codes() -> FrozenSet[str]:
+    # Codes come from the loader's SOP index, re-checked on its TTL; the definitions
+    # themselves are fetched only for the claims being processed
+    return sop_loader.sop_codes()
+
 async def get_batch_processable_claims():
     """Get all claims that have condition codes matching available SOPs."""
     try:
-        # Load all available SOPs
-        await sop_loader.load_all_async()
-        available_sop_codes = set(sop_loader._sop_definitions.keys())
+        # Codes from the SOP index, re-loaded once its TTL expires
+        available_sop_codes = _available_sop_codes()
 
         with get_db() as db:
-            # Get all claims with their condition codes
-            all_claims = crud.get_all_claims_with_details(db)
-
-            processable_claims = []
-            for claim in all_claims:
-                # Get condition codes for this claim
-                condition_codes = crud.get_condition_codes(db, claim['icn'])
-
-                # Check if any condition code matches an available SOP
-                matching_sops = [code for code in condition_codes if code in available_sop_codes]
-
-                if matching_sops:
-                    claim['matching_sops'] = matching_sops
-                    processable_claims.append(claim)
-
-            return processable_claims
+            # Matching happens in SQL; only claims with a matching SOP are loaded
+            return crud.get_claims_with_matching_sops(db, available_sop_codes)
 
     except Exception as e:
         logger.error(f"Error getting batch processable claims: {e}")
@@ -48,92 +37,133 @@ async def process_claims_batch(claims_to_process, progress_bar, status_text):
     successful_count = 0
     failed_count = 0
 
-    results = []
+    # Fetch the condition codes of every claim, then all their SOPs in one concurrent round
+    with get_db() as db:
+        codes_by_icn = crud.get_condition_codes_bulk(db, [claim['icn'] for claim in claims_to_process])
+    claim_condition_codes = {claim['icn']: codes_by_icn.get(claim['icn'], []) for claim in claims_to_process}
+    sops_by_code = await sop_loader.get_sops_async(
+        [code for codes in claim_condition_codes.values() for code in codes]
+    )
+
+    # Claims mostly wait on MCP and LLM calls, so a bounded number run at once
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
 
-    for i, claim in enumerate(claims_to_process):
+    async def process_one(index: int, claim: Dict[str, Any]):
         icn = claim['icn']
-        status_text.text(f"Processing claim {i+1}/{total_claims}: {icn}")
-        progress_bar.progress((i) / total_claims)
-
-        try:
-            # Get condition codes for this claim
-            with get_db() as db:
-                condition_codes = crud.get_condition_codes(db, icn)
-
-            # Find matching SOP
-            sop = None
-            found_code = None
-            for code in condition_codes:
-                sop = await sop_loader.get_sop_async(code)
-                if sop and getattr(sop, 'entry_point', None):
-                    found_code = code
-                    break
-
-            if not sop:
-                logger.warning(f"No SOP found for claim {icn} with condition codes: {condition_codes}")
-                failed_count += 1
-                results.append({
+        async with semaphore:
+            try:
+                condition_codes = claim_condition_codes[icn]
+
+                # Find matching SOP
+                sop = None
+                found_code = None
+                for code in condition_codes:
+                    sop = sops_by_code.get(code.upper())
+                    if sop and getattr(sop, 'entry_point', None):
+                        found_code = code
+                        break
+
+                if not sop:
+                    logger.warning(f"No SOP found for claim {icn} with condition codes: {condition_codes}")
+                    return index, {
+                        'icn': icn,
+                        'status': 'failed',
+                        'error': f'No SOP found for condition codes: {condition_codes}'
+                    }
+
+                # Process the claim
+                processor = ClaimProcessor(sop)
+                result = await processor.process_claim(icn)
+
+                return index, {
                     'icn': icn,
-                    'status': 'failed',
-                    'error': f'No SOP found for condition codes: {condition_codes}'
-                })
-                continue
-
-            # Process the claim
-            processor = ClaimProcessor(sop)
-            result = await processor.process_claim(icn)
+                    'status': 'success',
+                    'decision': result.get('decision'),
+                    'sop_code': found_code
+                }
 
+            except Exception as e:
+                logger.error(f"Error processing claim {icn}: {e}")
+                return index, {
+                    'icn': icn,
+                    'status': 'failed',
+                    'error': str(e)
+                }
+
+    # Results keep the input order; progress advances as each claim finishes, redrawn
+    # at most ~100 times so large batches do not flood the browser with deltas
+    update_every = max(1, total_claims // 100)
+    results: List[Optional[Dict[str, Any]]] = [None] * total_claims
+    for finished in asyncio.as_completed([process_one(i, claim) for i, claim in enumerate(claims_to_process)]):
+        index, outcome = await finished
+        results[index] = outcome
+        processed_count += 1
+        if outcome['status'] == 'success':
             successful_count += 1
-            results.append({
-                'icn': icn,
-                'status': 'success',
-                'decision': result.get('decision'),
-                'sop_code': found_code
-            })
-
-        except Exception as e:
-            logger.error(f"Error processing claim {icn}: {e}")
+        else:
             failed_count += 1
-            results.append({
-                'icn': icn,
-                'status': 'failed',
-                'error': str(e)
-            })
-
-        processed_count += 1
+        if processed_count % update_every == 0:
+            status_text.text(f"Processed claim {processed_count}/{total_claims}: {outcome['icn']}")
+            progress_bar.progress(processed_count / total_claims)
 
     progress_bar.progress(1.0)
     status_text.text(f"Bulk Claim processing completed: {successful_count} successful, {failed_count} failed out of {total_claims} claims")
 
     return results
 
-def get_grid_data_from_db():
-    """Fetches data for the main grid from the processed claims table."""
+@st.cache_data(ttl=60, show_spinner=False)
+def get_grid_data_from_db(version_token: str, limit: int, offset: int):
+    """Fetches one page of the main grid from the processed claims table.
+
+    Cached per version_token (see crud.get_processed_claims_version), so reruns
+    reuse the page until claims are processed or the TTL expires.
+    """
     with get_db() as db:
-        processed_claims = crud.get_all_processed_claims(db)
-    
-        grid_data = []
-        for processed_claim in processed_claims:
-            # The original claim details are now in the JSON blob
-            # We need to get the original claim header to display member and provider names
-            claim_header = crud.get_claim_header(db, processed_claim.icn)
-            grid_data.append({
-                "icn": processed_claim.icn,
-                "member_name": claim_header.member_name if claim_header else "N/A",
-                "provider_name": claim_header.provider_name if claim_header else "N/A",
-                "pend_code": processed_claim.sop_code,
-                "recommendation": processed_claim.decision,
-            })
-        return grid_data
+        rows = crud.get_processed_claims_with_headers(db, limit=limit, offset=offset)
+
+    return [
+        {
+            "icn": row["icn"],
+            "member_name": row["member_name"] if row["header_icn"] is not None else "N/A",
+            "provider_name": row["provider_name"] if row["header_icn"] is not None else "N/A",
+            "pend_code": row["sop_code"],
+            "recommendation": row["decision"],
+        }
+        for row in rows
+    ]
+
+def _step_details_json(step) -> str:
+    """Encode a step's details for st.json, splicing in the stored data JSON as-is.
+
+    st.json passes strings through unchanged, so the (possibly large) data blob
+    is never decoded here only to be re-encoded for display.
+    """
+    head = json.dumps({"timestamp": step["timestamp"], "query": step["query"]}, default=str)
+    tail = json.dumps({
+        "row_count": step["row_count"],
+        "execution_time_ms": step["execution_time_ms"],
+        "error": step["error"],
+    }, default=str)
+    return f'{head[:-1]}, "data": {step["data"] or "null"}, {tail[1:]}'
 
 def get_detailed_data_from_db(icn: str):
-    """Fetches detailed data for a specific claim from the database."""
+    """Fetches detailed data for a specific claim from the database.
+
+    Results are cached per (icn, results version), so reruns of the detail view
+    (e.g. Approve/Deny clicks) skip the queries until the claim is reprocessed.
+    """
+    with get_db() as db:
+        version = crud.get_claim_results_version(db, icn)
+    return _get_detailed_data_cached(icn, version)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _get_detailed_data_cached(icn: str, version: str):
     with get_db() as db:
     # Find the processed claim record for the final decision
-        processed_claim = db.query(ClaimProcessedLine).filter_by(icn=icn).first()
+        processed_claim = crud.get_claim_decision(db, icn)
         
         # Fetch the step-by-step processing details
-        processing_steps = crud.get_claim_processing_steps(db, icn)
+        processing_steps = crud.get_claim_processing_step_rows(db, icn)
         
         # We still need the original claim data for the summary and line items
         claim_data = crud.get_claim_with_lines(db, icn)
@@ -141,26 +171,20 @@ def get_detailed_data_from_db(icn: str):
         if not claim_data:
             return None
 
-        step_history = []
-        for step in processing_steps:
-            step_history.append({
-                "step": f"Step {step.step_number}: {step.description}",
-                "status": step.status,
-                "details": {
-                    "timestamp": step.timestamp,
-                    "query": step.query,
-                    "data": json.loads(step.data) if step.data else None,
-                    "row_count": step.row_count,
-                    "execution_time_ms": step.execution_time_ms,
-                    "error": step.error,
-                },
-            })
+        step_history = [
+            {
+                "step": f"Step {step['step_number']}: {step['description']}",
+                "status": step["status"],
+                "details": _step_details_json(step),
+            }
+            for step in processing_steps
+        ]
 
         detailed_data = {
             "claim_data": claim_data,
             "sop_results": {
-                "decision": processed_claim.decision if processed_claim else "Not Processed",
-                "decision_reason": processed_claim.decision_reason if processed_claim else "This claim has not been processed yet.",
+                "decision": processed_claim["decision"] if processed_claim else "Not Processed",
+                "decision_reason": processed_claim["decision_reason"] if processed_claim else "This claim has not been processed yet.",
                 "step_history": step_history,
             },
         }
@@ -175,11 +199,8 @@ def display_batch_processing_page(
     """Displays the Bulk Claim processing page with a grid of claims."""
     st.header("Bulk Claim Processing")
 
-    if "selected_icn" not in st.session_state:
-        st.session_state.selected_icn = None
-    
-    if "page_number" not in st.session_state:
-        st.session_state.page_number = 0
+    st.session_state.setdefault("selected_icn", None)
+    st.session_state.setdefault("page_number", 0)
 
     if st.session_state.selected_icn:
         # Detailed view
@@ -232,6 +253,11 @@ def display_batch_processing_page(
 
         with col2:
             if st.button("📊 Refresh Processed Claims", use_container_width=True):
+                # The caches already follow the version tokens; an explicit refresh also
+                # picks up changes the tokens do not cover, such as edited claim headers.
+                get_grid_data_from_db.clear()
+                _get_detailed_data_cached.clear()
+                st.session_state.pop("_grid_version", None)
                 st.rerun()
 
         # Show batch processing status/results
@@ -255,20 +281,10 @@ def display_batch_processing_page(
                     # Use a simple synchronous approach to avoid asyncio conflicts
                     # Load SOPs synchronously first
                     try:
-                        sop_loader.load_all()
-                        available_sop_codes = set(sop_loader._sop_definitions.keys())
+                        available_sop_codes = _available_sop_codes()
 
                         with get_db() as db:
-                            all_claims = crud.get_all_claims_with_details(db)
-                            processable_claims = []
-
-                            for claim in all_claims:
-                                condition_codes = crud.get_condition_codes(db, claim['icn'])
-                                matching_sops = [code for code in condition_codes if code in available_sop_codes]
-
-                                if matching_sops:
-                                    claim['matching_sops'] = matching_sops
-                                    processable_claims.append(claim)
+                            processable_claims = crud.get_claims_with_matching_sops(db, available_sop_codes)
 
                         st.session_state.batch_claims = processable_claims
                         st.session_state.batch_step = "processing_claims"
@@ -287,78 +303,20 @@ def display_batch_processing_page(
                         st.session_state.batch_processing = False
                         st.session_state.batch_step = "loading_claims"
 
-                # Step 2: Process claims one by one
+                # Step 2: Process claims
                 elif st.session_state.batch_step == "processing_claims":
                     claims_to_process = st.session_state.batch_claims
-                    total_claims = len(claims_to_process)
-
-                    # Process claims synchronously to avoid asyncio issues
-                    results = []
-                    successful_count = 0
-                    failed_count = 0
-
-                    for i, claim in enumerate(claims_to_process):
-                        icn = claim['icn']
-                        status_text.text(f"Processing claim {i+1}/{total_claims}: {icn}")
-                        progress_bar.progress((i) / total_claims)
-
-                        try:
-                            # Get condition codes for this claim
-                            with get_db() as db:
-                                condition_codes = crud.get_condition_codes(db, icn)
-
-                            # Find matching SOP (synchronous)
-                            sop = None
-                            found_code = None
-                            for code in condition_codes:
-                                sop = sop_loader.get_sop(code)
-                                if sop and getattr(sop, 'entry_point', None):
-                                    found_code = code
-                                    break
-
-                            if not sop:
-                                logger.warning(f"No SOP found for claim {icn} with condition codes: {condition_codes}")
-                                failed_count += 1
-                                results.append({
-                                    'icn': icn,
-                                    'status': 'failed',
-                                    'error': f'No SOP found for condition codes: {condition_codes}'
-                                })
-                                continue
-
-                            # Process the claim synchronously
-                            # Note: This will still use async internally but we'll handle it
-                            import nest_asyncio
-                            nest_asyncio.apply()  # Allow nested event loops
-
-                            async def process_single_claim():
-                                processor = ClaimProcessor(sop)
-                                return await processor.process_claim(icn)
-
-                            # Run in current event loop
-                            loop = asyncio.get_event_loop()
-                            result = loop.run_until_complete(process_single_claim())
-
-                            successful_count += 1
-                            results.append({
-                                'icn': icn,
-                                'status': 'success',
-                                'decision': result.get('decision'),
-                                'sop_code': found_code
-                            })
-
-                        except Exception as e:
-                            logger.error(f"Error processing claim {icn}: {e}")
-                            failed_count += 1
-                            results.append({
-                                'icn': icn,
-                                'status': 'failed',
-                                'error': str(e)
-                            })
-
-                    # Complete processing
-                    progress_bar.progress(1.0)
-                    status_text.text(f"Bulk Claim processing completed: {successful_count} successful, {failed_count} failed out of {total_claims} claims")
+
+                    # Claims run async internally; patch the current loop for nested
+                    # run_until_complete once per batch rather than per claim
+                    import nest_asyncio
+                    nest_asyncio.apply()  # Allow nested event loops
+                    loop = asyncio.get_event_loop()
+
+                    # Runs the claims concurrently and reports progress and the final summary
+                    results = loop.run_until_complete(
+                        process_claims_batch(claims_to_process, progress_bar, status_text)
+                    )
 
                     st.session_state.batch_results = results
                     st.session_state.batch_step = "completed"
@@ -387,54 +345,42 @@ def display_batch_processing_page(
         st.divider()
 
         # Grid view with pagination
-        grid_data = get_grid_data_from_db()
-        st.info(f"Showing {len(grid_data)} processed claims from the database.")
+        # The row count only changes with the version token, so pagination clicks skip the count query
+        with get_db() as db:
+            version_token = crud.get_processed_claims_version(db)
+            if st.session_state.get("_grid_version") != version_token:
+                st.session_state._grid_total = crud.count_processed_claims(db)
+                st.session_state._grid_version = version_token
+        total_rows = st.session_state._grid_total
+        st.info(f"Showing {total_rows} processed claims from the database.")
         
         page_size = 10
         page_number = st.session_state.page_number
-        total_pages = math.ceil(len(grid_data) / page_size) if grid_data else 1
-        
-        start_index = page_number * page_size
-        end_index = start_index + page_size
+        total_pages = -(-total_rows // page_size) if total_rows else 1
         
-        paginated_data = grid_data[start_index:end_index]
-        df = pd.DataFrame(paginated_data)
-
-        # Display header
-        col1, col2, col3, col4, col5, col6 = st.columns([2, 3, 3, 2, 2, 2])
-        with col1:
-            st.subheader("ICN")
-        with col2:
-            st.subheader("Member Name")
-        with col3:
-            st.subheader("Provider Name")
-        with col4:
-            st.subheader("Pend Code")
-        with col5:
-            st.subheader("AI Recommendation")
-        with col6:
-            st.subheader("Action")
-        
-        st.divider()
-
-        # Display grid data
-        if not df.empty:
-            for index, row in df.iterrows():
-                col1, col2, col3, col4, col5, col6 = st.columns([2, 3, 3, 2, 2, 2])
-                with col1:
-                    st.write(row["icn"])
-                with col2:
-                    st.write(row["member_name"])
-                with col3:
-                    st.write(row["provider_name"])
-                with col4:
-                    st.write(row["pend_code"])
-                with col5:
-                    st.write(row["recommendation"])
-                with col6:
-                    if st.button("View Details", key=f"view_{row['icn']}", use_container_width=True):
-                        st.session_state.selected_icn = row["icn"]
-                        st.rerun()
+        paginated_data = get_grid_data_from_db(version_token, limit=page_size, offset=page_number * page_size)
+
+        # Display grid data as a single dataframe; selecting a row opens its details
+        if paginated_data:
+            # st.dataframe takes the list of dicts directly; no intermediate DataFrame is built here
+            event = st.dataframe(
+                paginated_data,
+                column_config={
+                    "icn": "ICN",
+                    "member_name": "Member Name",
+                    "provider_name": "Provider Name",
+                    "pend_code": "Pend Code",
+                    "recommendation": "AI Recommendation",
+                },
+                hide_index=True,
+                on_select="rerun",
+                selection_mode="single-row",
+                use_container_width=True,
+                key=f"processed_claims_grid_{page_number}",
+            )
+            if event.selection.rows:
+                st.session_state.selected_icn = paginated_data[event.selection.rows[0]]["icn"]
+                st.rerun()
         else:
             st.info("No processed claims to display.")
 
@@ -186,29 +186,35 @@ def display_sop_upload_page():
                     st.error(f"File must contain the following columns: {', '.join(required_columns)} found {', '.join(df.columns)}")
                     return
 
+                sop_rows = []
+                for index, row in df.iterrows():
+                    try:
+                        # Convert row to dict and handle NaN values
+                        row_data = row.to_dict()
+                        # Replace NaN/None values with empty strings
+                        for key, value in row_data.items():
+                            if pd.isna(value) or value is None:
+                                row_data[key] = ""
+                        
+                        # Validate the SOP step with cleaned data
+                        sop_step = SOPStep(**row_data)
+                        sop_rows.append({
+                            "sop_code": sop_code,
+                            "step_number": sop_step.step_number,
+                            "description": sop_step.description,
+                            "query": sop_step.query or ""  # Ensure query is never None
+                        })
+                    except Exception as e:
+                        st.error(f"Error processing row {index + 1}: {e}")
+                        return
+
+                # Write all steps in one transaction instead of committing per row
                 with get_db() as db:
-                    for index, row in df.iterrows():
-                        try:
-                            # Convert row to dict and handle NaN values
-                            row_data = row.to_dict()
-                            # Replace NaN/None values with empty strings
-                            for key, value in row_data.items():
-                                if pd.isna(value) or value is None:
-                                    row_data[key] = ""
-                            
-                            # Create SOP step with cleaned data
-                            sop_step = SOPStep(**row_data)
-                            sop_crud.create_sop(
-                                db=db,
-                                sop_code=sop_code,
-                                step_number=sop_step.step_number,
-                                description=sop_step.description,
-                                query=sop_step.query or ""  # Ensure query is never None
-                            )
-                        except Exception as e:
-                            st.error(f"Error processing row {index + 1}: {e}")
-                            db.rollback()
-                            return
+                    try:
+                        sop_crud.create_sops_bulk(db, sop_rows)
+                    except Exception as e:
+                        st.error(f"Error saving SOP steps: {e}")
+                        return
                 
                 st.success(f"SOP '{sop_code}' uploaded successfully with {len(df)} steps.")
                 
@@ -240,10 +246,11 @@ async def process_claim(icn: str, progress_placeholder) -> tuple[Optional[Dict[s
                 return claim_data, None
 
             # Try to find an SOP for any of the condition codes
+            sops_by_code = await sop_loader.get_sops_async(condition_codes)
             sop = None
             found_code = None
             for code in condition_codes:
-                sop = await sop_loader.get_sop_async(code)
+                sop = sops_by_code.get(code.upper())
                 if sop and getattr(sop, "entry_point", None):
                     found_code = code
                     break
@@ -11,40 +11,23 @@ import json
 from langgraph.graph import StateGraph, END
 from langchain_core.runnables import RunnableConfig
 
-from ..core.mcp_client import mcp_langchain_client as mcp_client
+from ..core.mcp_client import get_mcp_langchain_client
 from ..sops.models import SOPDefinition, SOPStep
 from ..config.logging_config import logger
+from ..config.settings import settings
 from ..db.crud import crud
 from ..db.base import get_db
 from langchain_openai import AzureChatOpenAI
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-# Check required environment variables
-required_env_vars = [
-    "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT",
-    "AZURE_OPENAI_API_TYPE", "OPENAI_API_VERSION",
-    "AZURE_OPENAI_DEPLOYMENT_NAME", "MODEL_NAME"
-]
-missing_vars = [var for var in required_env_vars if not os.getenv(var)]
-if missing_vars:
-    error_msg = f"Missing required environment variables: {', '.join(missing_vars)}. Please check your .env file or environment settings."
-    logger.critical(error_msg)
-
-# Set environment variables for the LangChain Azure client library
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
-os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
-os.environ["AZURE_OPENAI_API_TYPE"] = os.getenv("AZURE_OPENAI_API_TYPE")
 
 try:
     # Initialize the AzureChatOpenAI client
     llm = AzureChatOpenAI(
         temperature=0,  # Use low temperature for deterministic, factual responses
-        azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-        model_name=os.getenv("MODEL_NAME"),
-        openai_api_version=os.getenv("OPENAI_API_VERSION")
+        azure_deployment=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
+        model_name=settings.MODEL_NAME,
+        openai_api_version=settings.OPENAI_API_VERSION,
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        api_key=settings.AZURE_OPENAI_API_KEY
     )
     logger.info("AzureChatOpenAI LLM client initialized successfully.")
 except Exception as e:
@@ -191,7 +174,7 @@ class ClaimProcessor:
                 # Templating ICN
                 sql_to_run = sql.replace("{icn}", state["icn"])
                 try:
-                    qres = await mcp_client.execute_query(sql_to_run)
+                    qres = await get_mcp_langchain_client().execute_query(sql_to_run)
                 except Exception as e:
                     logger.error(f"Error executing SQL for step {step.step_number}: {e}", exc_info=True)
                     exec_result["status"] = "failed"
@@ -219,18 +202,7 @@ class ClaimProcessor:
             })
             state["last_ran_step"] = f"Step {step.step_number}"
 
-            # Save the step result to the database
-            try:
-                with get_db() as db:
-                    crud.create_claim_processing_step(
-                        db=db,
-                        icn=state["icn"],
-                        sop_code=self.sop.sop_code,
-                        step_data=exec_result
-                    )
-            except Exception as e:
-                logger.error(f"Failed to save processing step for ICN {state['icn']}, step {step.step_number}: {e}", exc_info=True)
-
+            # Step results are persisted together once the workflow finishes
             return state
 
         # Keep function metadata nice for debug
@@ -277,11 +249,30 @@ class ClaimProcessor:
             }
 
         # Debug logging for step results
-        logger.info(f"Final state step_results: {json.dumps(final_state.get('step_results', {}), indent=2, default=str)}")
+        logger.opt(lazy=True).debug(
+            "Final state step_results: {}",
+            lambda: json.dumps(final_state.get('step_results', {}), indent=2, default=str)
+        )
         
-        # Save the results to the database
+        # Save the step results in one batch, then the final decision
+        step_results = sorted(
+            final_state.get("step_results", {}).values(),
+            key=lambda result: result.get("step_number", 0)
+        )
+        # One session for both writes; each helper commits (or rolls back) its own
+        # transaction, so a failed step insert does not lose the decision
         try:
             with get_db() as db:
+                try:
+                    crud.create_claim_processing_steps_bulk(
+                        db=db,
+                        icn=final_state["icn"],
+                        sop_code=final_state["sop_code"],
+                        steps=step_results
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to save processing steps for ICN {icn}: {e}", exc_info=True)
+
                 crud.create_claim_processed(
                     db=db,
                     icn=final_state["icn"],
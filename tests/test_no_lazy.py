@@ -0,0 +1,150 @@
+"""Guards against lazy loads (N+1 queries) creeping back into the claim read paths.
+
+Every test runs against an in-memory SQLite database. ORM queries issued through
+the fixture session get raiseload('*'), so touching a relationship that was not
+eagerly loaded raises instead of silently emitting a SELECT, and a cursor-level
+counter caps the number of statements each read may issue.
+"""
+import os
+from contextlib import contextmanager
+
+# Settings are read at import time; give the required ones harmless values
+for _name in (
+    "GEMINI_API_KEY",
+    "AZURE_OPENAI_API_KEY",
+    "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_API_TYPE",
+    "OPENAI_API_VERSION",
+    "AZURE_OPENAI_DEPLOYMENT_NAME",
+    "MODEL_NAME",
+):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, raiseload, selectinload
+from sqlalchemy.pool import NullPool, StaticPool
+
+from app.db.base import Base, get_async_db
+from app.db.crud import crud
+from app.main import app
+from app.models.claims import ClaimHeader, ClaimLine
+from app.models.sops import SOP  # noqa: F401  (registers the SOP table on Base.metadata)
+
+# Shared-cache in-memory database, so the sync fixture engine and the async engine
+# behind the API see the same data while the sync engine holds its connection open
+_DB_URI = "file:test_no_lazy?mode=memory&cache=shared&uri=true"
+
+ICN = "ICN0001"
+
+
+@contextmanager
+def count_queries(engine):
+    """Collect every statement the engine sends to the database inside the block."""
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _raiseload_everything(orm_execute_state):
+    """Apply raiseload('*') to every ORM entity query run by the session."""
+    if (
+        orm_execute_state.is_select
+        and orm_execute_state.all_mappers
+        and not orm_execute_state.is_column_load
+        and not orm_execute_state.is_relationship_load
+    ):
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload("*"))
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(f"sqlite:///{_DB_URI}", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(ClaimHeader(
+            icn=ICN,
+            member_name="Jane Doe",
+            provider_name="General Hospital",
+            claim_lines=[
+                ClaimLine(line_no=1, procedure_code="99213", condition_code="B007"),
+                ClaimLine(line_no=2, procedure_code="81002"),
+            ],
+        ))
+        db.commit()
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    with Session(engine) as session:
+        event.listen(session, "do_orm_execute", _raiseload_everything)
+        yield session
+
+
+@pytest.fixture
+def api_client(engine):
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{_DB_URI}", poolclass=NullPool)
+    sessionmaker = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with sessionmaker() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        # Not entered as a context manager, so the startup lifespan does not touch the real database
+        yield TestClient(app), async_engine.sync_engine
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+
+
+def test_get_claim_with_lines_issues_at_most_two_queries(engine, db):
+    with count_queries(engine) as queries:
+        claim = crud.get_claim_with_lines(db, ICN, cache=False)
+
+    assert claim["icn"] == ICN
+    assert [line["line_no"] for line in claim["claim_lines"]] == [1, 2]
+    assert len(queries) <= 2, queries
+
+
+def test_claim_endpoint_issues_at_most_two_queries(api_client):
+    client, engine = api_client
+    with count_queries(engine) as queries:
+        response = client.get(f"/api/claims/{ICN}")
+
+    assert response.status_code == 200
+    assert len(response.json()["claim_lines"]) == 2
+    assert len(queries) <= 2, queries
+
+
+def test_eager_loaded_claim_lines_need_no_further_queries(engine, db):
+    header = db.execute(
+        select(ClaimHeader).options(selectinload(ClaimHeader.claim_lines), raiseload("*"))
+    ).scalar_one()
+
+    with count_queries(engine) as queries:
+        lines = header.claim_lines
+
+    assert [line.line_no for line in lines] == [1, 2]
+    assert queries == []
+
+
+def test_unloaded_relationship_raises(db):
+    line = db.execute(select(ClaimLine).where(ClaimLine.icn == ICN, ClaimLine.line_no == 1)).scalar_one()
+
+    with pytest.raises(InvalidRequestError):
+        line.header